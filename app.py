@@ -1,6 +1,6 @@
 from flask import Flask, redirect, url_for
 from flask_login import LoginManager
-from modules.extensions import agent
+from modules import extensions
 from modules.db import init_db
 from modules.config import load_settings
 from modules.routes.auth import auth_bp, load_user_from_db
@@ -11,59 +11,83 @@ from modules.routes.extensions import ext_bp
 import os
 import sys
 import signal
+import importlib.util
 
-# Ensure database is initialized
-init_db()
+from modules.tasks import get_scheduler
 
-if "--help" in sys.argv or "-h" in sys.argv:
-    print("Usage: python app.py [options]")
-    print("Options:")
-    print("  -h, --help    Show this help message and exit")
-    print("  /gui          Launch in GUI mode (handled by run.bat)")
-    sys.exit(0)
+def create_app():
+    """Build the Flask app. Runs in the serving process, not on import."""
+    # Ensure database is initialized
+    init_db()
+    # The agent (plugin scan, permissions table, worker threads) is built here, not on import
+    extensions.get_agent()
 
-app = Flask(__name__)
-app.secret_key = os.environ.get("SECRET_KEY", "genesis_secret_key_123")
+    app = Flask(__name__)
+    app.secret_key = os.environ.get("SECRET_KEY", "genesis_secret_key_123")
 
-# Initialize Login Manager
-login_manager = LoginManager()
-login_manager.init_app(app)
-login_manager.login_view = "auth.login" # Updated view name
+    # Initialize Login Manager
+    login_manager = LoginManager()
+    login_manager.init_app(app)
+    login_manager.login_view = "auth.login" # Updated view name
 
-@login_manager.user_loader
-def load_user(user_id):
-    return load_user_from_db(user_id)
+    @login_manager.user_loader
+    def load_user(user_id):
+        return load_user_from_db(user_id)
 
-# Register Blueprints
-app.register_blueprint(auth_bp)
-app.register_blueprint(main_bp)
-app.register_blueprint(chat_bp)
-app.register_blueprint(admin_bp)
-app.register_blueprint(ext_bp)
+    # Register Blueprints
+    app.register_blueprint(auth_bp)
+    app.register_blueprint(main_bp)
+    app.register_blueprint(chat_bp)
+    app.register_blueprint(admin_bp)
+    app.register_blueprint(ext_bp)
 
-from modules.routes.keys import keys_bp
-app.register_blueprint(keys_bp)
+    from modules.routes.keys import keys_bp
+    app.register_blueprint(keys_bp)
 
-# Start Task Scheduler
-from modules.tasks import get_scheduler
-get_scheduler().start()
+    return app
 
 # Signal Handler
 def signal_handler(sig, frame):
     print("\n[System] Shutdown signal received. Cleaning up...")
-    if agent:
-        agent.shutdown()
+    if extensions.agent:
+        extensions.agent.shutdown()
     get_scheduler().stop()
     os._exit(0)
 
-signal.signal(signal.SIGINT, signal_handler)
-
 if __name__ == "__main__":
+    if "--help" in sys.argv or "-h" in sys.argv:
+        print("Usage: python app.py [options]")
+        print("Options:")
+        print("  -h, --help    Show this help message and exit")
+        print("  --dev         Use the Flask development server instead of gunicorn")
+        print("  /gui          Launch in GUI mode (handled by run.bat)")
+        sys.exit(0)
+
     settings = load_settings()
     server_cfg = settings.get("server", {})
     host = server_cfg.get("host", "127.0.0.1")
     port = server_cfg.get("port", 5000)
     debug = server_cfg.get("debug", False)
     
-    print(f"Starting Genesis AI on http://{host}:{port}")
-    app.run(host=host, port=port, debug=debug, use_reloader=False)
+    # gunicorn has no Windows support, so the dev server stays the default there
+    use_dev_server = "--dev" in sys.argv or os.name == "nt"
+    if not use_dev_server and importlib.util.find_spec("gunicorn") is None:
+        print("[System] gunicorn not installed, falling back to the development server.")
+        use_dev_server = True
+
+    if use_dev_server:
+        app = create_app()
+        signal.signal(signal.SIGINT, signal_handler)
+        # Start Task Scheduler (under gunicorn one worker starts it, see gunicorn.conf.py)
+        get_scheduler().start()
+        print(f"Starting Genesis AI on http://{host}:{port}")
+        app.run(host=host, port=port, debug=debug, use_reloader=False, threaded=True)
+    else:
+        base_dir = os.path.dirname(os.path.abspath(__file__))
+        print(f"Starting Genesis AI (gunicorn) on http://{host}:{port}")
+        os.execv(sys.executable, [
+            sys.executable, "-m", "gunicorn",
+            "--chdir", base_dir,
+            "-c", os.path.join(base_dir, "gunicorn.conf.py"),
+            "app:create_app()"
+        ])
@@ -2,6 +2,15 @@ import sys
 import json
 import os
 
+try:
+    import orjson
+    _dumps = orjson.dumps
+    _loads = orjson.loads
+except ImportError:
+    def _dumps(obj):
+        return json.dumps(obj).encode("utf-8")
+    _loads = json.loads
+
 def main():
     # Read args from stdin
     try:
@@ -9,7 +18,7 @@ def main():
         if not input_data:
             args = {}
         else:
-            args = json.loads(input_data)
+            args = _loads(input_data)
         
         name = args.get("name", "World")
         
@@ -22,7 +31,8 @@ def main():
         }
         
         # Write response to stdout
-        print(json.dumps(response))
+        sys.stdout.buffer.write(_dumps(response) + b"\n")
+        sys.stdout.flush()
         
     except Exception as e:
         print(json.dumps({"error": str(e)}), file=sys.stderr)
@@ -5,13 +5,165 @@ import re
 import time
 import platform
 
+# orjson writes bytes directly; fall back to stdlib when the plugin venv lacks it
+try:
+    import orjson
+    _dumps = orjson.dumps
+    _loads = orjson.loads
+except ImportError:
+    def _dumps(obj):
+        return json.dumps(obj).encode("utf-8")
+    _loads = json.loads
+
+# Platform details don't change during a run; resolve them once
+IS_WINDOWS = platform.system() == "Windows"
+SYSTEM_DRIVE = os.environ.get("SystemDrive", "C:")
+SYSTEM_ROOT = os.environ.get("SystemRoot", "C:\\Windows")
+TEMP_DIR = os.environ.get("TEMP", os.path.join(SYSTEM_DRIVE, "Temp"))
+PROGRAM_DATA = os.environ.get("ProgramData", "C:\\ProgramData")
+
+# Directories to skip (names starting with '.' are skipped as well)
+SKIP_DIRS = frozenset({
+    '$RECYCLE.BIN', 'System Volume Information', 'Windows', 'ProgramData',
+    '.git', '__pycache__', 'node_modules', 'venv', 'env'
+})
+
+# Results are capped; the scan stops as soon as this many files match
+MAX_MATCHES = 100
+
+# Characters that make a query a regex rather than a plain substring
+REGEX_META = set(r".^$*+?{}[]\|()")
+
+# Output is batched so a busy scan doesn't pay a pipe write per progress/match line
+FLUSH_BYTES = 65536
+FLUSH_INTERVAL = 0.25
+_out_buf = bytearray()
+_last_flush = time.monotonic()
+
+# os.fwalk walks from directory fds (openat/fstatat), so deep trees aren't
+# re-resolved from the root for every folder and stat; POSIX only
+HAS_FWALK = hasattr(os, "fwalk")
+
+def _walk_fds(root_path):
+    """Yields (folder, file_names, size_of) per folder using os.fwalk."""
+    for root, dirs, files, rootfd in os.fwalk(root_path):
+        dirs[:] = [d for d in dirs if d[0] != '.' and d not in SKIP_DIRS]
+
+        def size_of(name, fd=rootfd):
+            return os.stat(name, dir_fd=fd).st_size
+
+        yield root, files, size_of
+
+def _walk_scandir(root_path):
+    """Yields (folder, file_names, size_of) per folder using an os.scandir stack."""
+    # DirEntry caches the type (and on Windows the size) from the directory
+    # listing, saving a stat per entry.
+    is_skipped_dir = SKIP_DIRS.__contains__
+    stack = [root_path]
+    while stack:
+        root = stack.pop()
+        try:
+            with os.scandir(root) as it:
+                entries = list(it)
+        except OSError:
+            # Unreadable folder (permission denied, vanished) - skip like os.walk did
+            continue
+
+        files = {}
+        for entry in entries:
+            name = entry.name
+            try:
+                if entry.is_dir():
+                    # Symlinked folders are listed but not descended, as with os.walk
+                    if name[0] != '.' and not is_skipped_dir(name) and not entry.is_symlink():
+                        stack.append(entry.path)
+                    continue
+            except OSError:
+                continue
+            files[name] = entry
+
+        yield root, files, lambda name: files[name].stat().st_size
+
+if IS_WINDOWS:
+    import ctypes
+    from ctypes import wintypes
+
+    FIND_EX_INFO_BASIC = 1           # skip the 8.3 short name lookup
+    FIND_EX_SEARCH_NAME_MATCH = 0
+    FIND_FIRST_EX_LARGE_FETCH = 2    # larger directory reads per call
+    FILE_ATTRIBUTE_DIRECTORY = 0x10
+    FILE_ATTRIBUTE_REPARSE_POINT = 0x400
+    IO_REPARSE_TAG_SYMLINK = 0xA000000C
+    INVALID_HANDLE_VALUE = wintypes.HANDLE(-1).value
+
+    _kernel32 = ctypes.WinDLL("kernel32", use_last_error=True)
+    _FindFirstFileExW = _kernel32.FindFirstFileExW
+    _FindFirstFileExW.argtypes = [wintypes.LPCWSTR, ctypes.c_int, ctypes.c_void_p,
+                                  ctypes.c_int, ctypes.c_void_p, wintypes.DWORD]
+    _FindFirstFileExW.restype = wintypes.HANDLE
+    _FindNextFileW = _kernel32.FindNextFileW
+    _FindNextFileW.argtypes = [wintypes.HANDLE, ctypes.c_void_p]
+    _FindNextFileW.restype = wintypes.BOOL
+    _FindClose = _kernel32.FindClose
+    _FindClose.argtypes = [wintypes.HANDLE]
+    _FindClose.restype = wintypes.BOOL
+
+def _walk_win32(root_path):
+    """Yields (folder, file_names, size_of) per folder using FindFirstFileExW."""
+    # Sizes come straight from WIN32_FIND_DATAW, so matches need no extra stat
+    data = wintypes.WIN32_FIND_DATAW()
+    stack = [root_path]
+    while stack:
+        root = stack.pop()
+        root_prefix = root if root.endswith(os.sep) else root + os.sep
+        handle = _FindFirstFileExW(root_prefix + "*", FIND_EX_INFO_BASIC, ctypes.byref(data),
+                                   FIND_EX_SEARCH_NAME_MATCH, None, FIND_FIRST_EX_LARGE_FETCH)
+        if handle == INVALID_HANDLE_VALUE:
+            # Unreadable folder (permission denied, vanished) - skip like os.walk did
+            continue
+
+        sizes = {}
+        try:
+            while True:
+                name = data.cFileName
+                attrs = data.dwFileAttributes
+                if attrs & FILE_ATTRIBUTE_DIRECTORY:
+                    # '.'/'..' fall under the dot rule; symlinked folders aren't descended
+                    if (name[0] != '.' and name not in SKIP_DIRS
+                            and not (attrs & FILE_ATTRIBUTE_REPARSE_POINT and data.dwReserved0 == IO_REPARSE_TAG_SYMLINK)):
+                        stack.append(root_prefix + name)
+                else:
+                    sizes[name] = (data.nFileSizeHigh << 32) | data.nFileSizeLow
+                if not _FindNextFileW(handle, ctypes.byref(data)):
+                    break
+        finally:
+            _FindClose(handle)
+
+        yield root, sizes, sizes.__getitem__
+
+def flush_output():
+    """Writes any buffered JSON lines to stdout."""
+    global _last_flush
+    if _out_buf:
+        sys.stdout.buffer.write(_out_buf)
+        sys.stdout.flush()
+        _out_buf.clear()
+    _last_flush = time.monotonic()
+
+def emit(obj):
+    """Queues one JSON line, flushing once 64 KiB or 250 ms have accumulated."""
+    _out_buf.extend(_dumps(obj))
+    _out_buf.extend(b"\n")
+    if len(_out_buf) >= FLUSH_BYTES or time.monotonic() - _last_flush >= FLUSH_INTERVAL:
+        flush_output()
+
 def main():
     try:
         input_data = {}
         # 1. Parse Input
         if len(sys.argv) >= 2:
             try:
-                input_data = json.loads(sys.argv[1])
+                input_data = _loads(sys.argv[1])
             except json.JSONDecodeError:
                 pass 
         
@@ -20,12 +172,12 @@ def main():
             try:
                 stdin_content = sys.stdin.read().strip()
                 if stdin_content:
-                    input_data = json.loads(stdin_content)
+                    input_data = _loads(stdin_content)
             except Exception:
                 pass
         
         if not input_data:
-            print(json.dumps({"error": "No input provided"}))
+            emit({"error": "No input provided"})
             return
 
         input_data = input_data or {}
@@ -33,7 +185,7 @@ def main():
         raw_path = input_data.get("path") or ""
 
         # Linux-to-Windows Path Conversion
-        if platform.system() == "Windows" and raw_path:
+        if IS_WINDOWS and raw_path:
             raw_path = raw_path.replace("/", "\\") # basic slash fix first
             
             # 1. Home Directory (~ or /home/user)
@@ -46,21 +198,20 @@ def main():
                     username = parts[2]
                     # Map to C:\Users\username
                     # Note: We can't guarantee drive letter is C, but it's 99% likely for Users
-                    raw_path = os.path.join(os.environ.get("SystemDrive", "C:"), "Users", username, *parts[3:])
+                    raw_path = os.path.join(SYSTEM_DRIVE, "Users", username, *parts[3:])
             
             # 2. Temp Directory (/tmp)
             elif raw_path == "\\tmp" or raw_path.startswith("\\tmp\\"):
-                temp_dir = os.environ.get("TEMP", os.path.join(os.environ.get("SystemDrive", "C:"), "Temp"))
-                raw_path = temp_dir + raw_path[4:]
+                raw_path = TEMP_DIR + raw_path[4:]
             
             # 3. System Config (/etc -> C:\Windows\System32\drivers\etc for hosts, or just System32?)
             # Usually users mean 'config' area. Let's map to System32/drivers/etc just in case
             elif raw_path == "\\etc" or raw_path.startswith("\\etc\\"):
-                raw_path = os.path.join(os.environ.get("SystemRoot", "C:\\Windows"), "System32", "drivers", "etc") + raw_path[4:]
+                raw_path = os.path.join(SYSTEM_ROOT, "System32", "drivers", "etc") + raw_path[4:]
 
             # 4. Logs (/var/log -> C:\ProgramData)
             elif raw_path.startswith("\\var\\log"):
-                raw_path = os.environ.get("ProgramData", "C:\\ProgramData") + raw_path[8:]
+                raw_path = PROGRAM_DATA + raw_path[8:]
         
         # Determine Search Roots
         search_roots = []
@@ -68,7 +219,7 @@ def main():
         # Check if path is effectively root "/" or empty
         is_root_request = raw_path.strip() in ['/', '\\', '']
         
-        if is_root_request and platform.system() == "Windows":
+        if is_root_request and IS_WINDOWS:
             # Enumerate all available drives
             import string
             from ctypes import windll
@@ -90,51 +241,58 @@ def main():
 
         # Validate inputs
         if not query:
-             print(json.dumps({"error": "No query provided"}))
+             emit({"error": "No query provided"})
              return
              
+        # Plain substrings skip the regex engine; str 'in' is a much cheaper C loop
+        is_regex = any(c in REGEX_META for c in query)
+        q_low = query.lower()
+
         # Compile Regex
-        try:
-            pattern = re.compile(query, re.IGNORECASE)
-        except re.error as e:
-            print(json.dumps({"error": f"Invalid Regex: {e}"}))
-            return
+        pattern = None
+        if is_regex:
+            try:
+                pattern = re.compile(query, re.IGNORECASE)
+            except re.error as e:
+                emit({"error": f"Invalid Regex: {e}"})
+                return
 
         matches = []
         scanned_count = 0
         total_folders = 0
         start_time = time.time()
         
-        # Directories to skip
-        SKIP_DIRS = {
-            '$RECYCLE.BIN', 'System Volume Information', 'Windows', 'ProgramData', 
-            '.git', '__pycache__', 'node_modules', 'venv', 'env'
-        }
-
         # 2. Walk
         for root_path in search_roots:
             if not os.path.exists(root_path):
                 continue
                 
+            if IS_WINDOWS:
+                walk = _walk_win32
+            elif HAS_FWALK and not os.path.islink(root_path):
+                walk = _walk_fds
+            else:
+                # fwalk skips a symlinked top folder entirely, so those use scandir
+                walk = _walk_scandir
+
             try:
-                for root, dirs, files in os.walk(root_path, topdown=True):
+                for root, files, size_of in walk(root_path):
                     total_folders += 1
-                    
-                    # Modify dirs in-place to skip
-                    dirs[:] = [d for d in dirs if d not in SKIP_DIRS and not d.startswith('.')]
-                    
+                    # Drive roots ("C:\\", "/") already end in a separator
+                    root_prefix = root if root.endswith(os.sep) else root + os.sep
+
                     # Progress Update every 10 folders
                     if total_folders % 10 == 0:
                         # Send specific 'action_update' message for UI
-                         print(json.dumps({
+                         emit({
                             "status": "progress", 
                             "message": f"Scanning {root}...",
                             "scanned": scanned_count,
                             "found": len(matches)
-                        }), flush=True)
+                        })
 
                     last_update_time = time.time()
-                    
+
                     for file in files:
                         scanned_count += 1
                         
@@ -143,60 +301,48 @@ def main():
                         elapsed = current_time - start_time
                         if current_time - last_update_time >= 1.5:
                             speed = round(scanned_count / elapsed, 1) if elapsed > 0 else 0
-                            print(json.dumps({
+                            emit({
                                 "status": "progress", 
                                 "message": f"Scanning {root}...",
                                 "scanned": scanned_count,
                                 "found": len(matches),
                                 "elapsed": round(elapsed, 1),
                                 "speed": speed
-                            }), flush=True)
+                            })
                             last_update_time = current_time
 
-                        if pattern.search(file):
-                            full_path = os.path.join(root, file)
+                        if (pattern.search(file) if is_regex else q_low in file.lower()):
+                            full_path = root_prefix + file
                             try:
-                                size = os.path.getsize(full_path)
-                            except:
+                                size = size_of(file)
+                            except OSError:
                                 size = 0
-                                
-                            matches.append({
+
+                            # Stored raw; slashes are normalized once in the final result
+                            match = {
                                 "name": file,
-                                "path": full_path.replace("\\", "/"),
+                                "path": full_path,
                                 "size": size
-                            })
-                            
+                            }
+                            matches.append(match)
+
                             # Real-time Match Emission
                             elapsed = current_time - start_time
                             speed = round(scanned_count / elapsed, 1) if elapsed > 0 else 0
-                            print(json.dumps({
+                            emit({
                                 "status": "match",
-                                "file": matches[-1],
+                                "file": dict(match, path=full_path.replace("\\", "/")) if IS_WINDOWS else match,
                                 "scanned": scanned_count,
                                 "found": len(matches),
                                 "elapsed": round(elapsed, 1),
                                 "speed": speed
-                            }), flush=True)
-                            try:
-                                size = os.path.getsize(full_path)
-                            except:
-                                size = 0
-                                
-                            matches.append({
-                                "name": file,
-                                "path": full_path.replace("\\", "/"),
-                                "size": size
                             })
-                            
-                            # Real-time Match Emission
-                            print(json.dumps({
-                                "status": "match",
-                                "file": matches[-1],
-                                "scanned": scanned_count,
-                                "found": len(matches)
-                            }), flush=True)
-                            
-                    if len(matches) >= 100:
+
+                            # Stop mid-folder once the cap trips; nothing past it is reported
+                            if len(matches) >= MAX_MATCHES:
+                                break
+
+                    if len(matches) >= MAX_MATCHES:
                         break
                 
             except Exception as e:
@@ -204,16 +350,21 @@ def main():
                 # print(f"Error scanning {root_path}: {e}", file=sys.stderr)
                 continue
                 
-            if len(matches) >= 100:
+            if len(matches) >= MAX_MATCHES:
                 break
         
-        if len(matches) >= 100:
-             print(json.dumps({
+        if len(matches) >= MAX_MATCHES:
+             emit({
                 "status": "progress", 
-                "message": "Match limit reached (100). Stopping."
-            }), flush=True)
+                "message": f"Match limit reached ({MAX_MATCHES}). Stopping."
+            })
 
         # 3. Final Output
+        # Only Windows paths carry backslash separators; POSIX names may legitimately contain '\\'
+        if IS_WINDOWS:
+            for m in matches:
+                m["path"] = m["path"].replace("\\", "/")
+
         result = {
             "matches": matches,
             "count": len(matches),
@@ -221,10 +372,13 @@ def main():
             "folders_scanned": total_folders,
             "duration_seconds": round(time.time() - start_time, 2)
         }
-        print(json.dumps(result))
+        emit(result)
 
     except Exception as e:
-        print(json.dumps({"error": str(e)}))
+        emit({"error": str(e)})
 
 if __name__ == "__main__":
-    main()
+    try:
+        main()
+    finally:
+        flush_output()
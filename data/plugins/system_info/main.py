@@ -1,105 +1,75 @@
 import psutil
-
 import json
-
 import os
-
 import sys
-
 import platform
-
-
+import time
+import subprocess
+import threading
+
+# Host identity and total RAM don't change while the plugin runs; resolve them once
+IS_WINDOWS = platform.system() == "Windows"
+_STATIC = {
+    "system": platform.node(),
+    "os": f"{platform.system()} {platform.release()}",
+    "ram_max": f"{psutil.virtual_memory().total / (1024**3):.1f}GB",
+}
+
+# nvidia-smi costs a process spawn per call; reuse the reading for a few seconds
+GPU_CACHE_SECONDS = 5.0
+_GPU_CACHE = {"v": None, "t": 0.0}
+
+# cpu_percent(interval=...) sleeps for the whole interval; sample in the
+# background instead so calls from the persistent worker return immediately
+CPU_SAMPLE_SECONDS = 1.0
+_CPU = {"percent": None}
+
+def _sample_cpu():
+    psutil.cpu_percent(None)  # Prime the baseline for the first delta
+    while True:
+        time.sleep(CPU_SAMPLE_SECONDS)
+        _CPU["percent"] = psutil.cpu_percent(None)
+
+threading.Thread(target=_sample_cpu, name="cpu-sampler", daemon=True).start()
 
 def get_gpu_stats():
-
     """
-
     Attempts to retrieve GPU information via nvidia-smi.
-
     Returns 'N/A/N/A' if tools are missing or fail.
-
     """
+    now = time.time()
+    if _GPU_CACHE["v"] is not None and now - _GPU_CACHE["t"] < GPU_CACHE_SECONDS:
+        return _GPU_CACHE["v"]
 
     try:
-
-        import subprocess
-
-        gpu_info = subprocess.check_output(
-
-            ["nvidia-smi", "--query-gpu=memory.free,memory.total", "--format=csv,nounits,noheader"], 
-
-            encoding='utf-8'
-
+        proc = subprocess.run(
+            ["nvidia-smi", "--query-gpu=memory.free,memory.total", "--format=csv,nounits,noheader"],
+            capture_output=True, text=True, encoding='utf-8', timeout=1.0
         )
-
-        free, total = gpu_info.strip().split(',')
-
-        return f"{free.strip()}MB/{total.strip()}MB"
-
+        # Multi-GPU hosts print one row per card; report the first
+        free, total = proc.stdout.strip().splitlines()[0].split(',')
+        value = f"{free.strip()}MB/{total.strip()}MB"
     except Exception:
+        value = "N/A/N/A"
 
-        return "N/A/N/A"
-
-
-
-def main():
-
-    # System Name
-
-    system_name = platform.node()
-
-
-
-    # RAM Stats
+    _GPU_CACHE.update(v=value, t=now)
+    return value
 
-    vm = psutil.virtual_memory()
-
-    ram_free = f"{vm.available / (1024**3):.1f}GB"
-
-    ram_max = f"{vm.total / (1024**3):.1f}GB"
-
-    
-
-    # CPU Stats
-
-    # 'Free' CPU is calculated as (100 - usage percentage)
-
-    cpu_usage = psutil.cpu_percent(interval=0.1)
-
-import psutil
-import json
-import os
-import sys
-import platform
-
-def get_gpu_stats():
-    """
-    Attempts to retrieve GPU information via nvidia-smi.
-    Returns 'N/A/N/A' if tools are missing or fail.
-    """
-    try:
-        import subprocess
-        gpu_info = subprocess.check_output(
-            ["nvidia-smi", "--query-gpu=memory.free,memory.total", "--format=csv,nounits,noheader"], 
-            encoding='utf-8'
-        )
-        free, total = gpu_info.strip().split(',')
-        return f"{free.strip()}MB/{total.strip()}MB"
-    except Exception:
-        return "N/A/N/A"
-
-def main():
+def execute(args, context):
+    """Entry point for the persistent worker; returns the stats as plain text."""
     # System Name
-    system_name = platform.node()
+    system_name = _STATIC["system"]
 
-    # RAM Stats
-    vm = psutil.virtual_memory()
-    ram_free = f"{vm.available / (1024**3):.1f}GB"
-    ram_max = f"{vm.total / (1024**3):.1f}GB"
+    # RAM Stats (only availability changes between calls)
+    ram_free = f"{psutil.virtual_memory().available / (1024**3):.1f}GB"
+    ram_max = _STATIC["ram_max"]
     
     # CPU Stats
     # 'Free' CPU is calculated as (100 - usage percentage)
-    cpu_usage = psutil.cpu_percent(interval=0.1)
+    cpu_usage = _CPU["percent"]
+    if cpu_usage is None:
+        # No background sample yet (one-shot run or first second of a worker)
+        cpu_usage = psutil.cpu_percent(interval=0.1)
     cpu_free = f"{100 - cpu_usage:.1f}%"
     cpu_max = "100%"
     
@@ -107,10 +77,10 @@ def main():
     gpu_string = get_gpu_stats()
     
     # OS Info
-    os_info = f"{platform.system()} {platform.release()}"
+    os_info = _STATIC["os"]
     
     # Prompt Hint for AI
-    if platform.system() == "Windows":
+    if IS_WINDOWS:
         path_hint = "Make sure to use Windows style paths (or forward slashes which Python accepts). Use PowerShell syntax for commands."
     else:
         path_hint = "Use Linux/Unix style paths and Bash syntax."
@@ -118,8 +88,11 @@ def main():
     # Format the updated output string
     result_string = f"[IMPORTANT: {path_hint}]\nSystem: {system_name}  OS: {os_info}  RAM: {ram_free}/{ram_max}  CPU: {cpu_free}/{cpu_max}  GPU: {gpu_string}"
     
+    return result_string
+
+def main():
     # Genesis Action protocol: Return Plain Text via stdout
-    print(result_string)
+    print(execute({}, {}))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,44 @@
+"""
+Gunicorn configuration for Genesis AI.
+Usage: gunicorn -c gunicorn.conf.py "app:create_app()"
+"""
+from modules.config import load_settings
+
+_server_cfg = load_settings().get("server", {})
+
+bind = f"{_server_cfg.get('host', '127.0.0.1')}:{_server_cfg.get('port', 5000)}"
+
+# Threads overlap the blocking I/O (LLM calls, SQLite, plugin subprocesses).
+# The agent keeps live chat streams, cancel handles and loaded models in process
+# memory, so scale with threads and only raise `workers` for stateless setups.
+worker_class = "gthread"
+workers = _server_cfg.get("workers", 1)
+threads = _server_cfg.get("threads", 5)
+
+# No preload_app: create_app() builds the agent, and threads it starts in the master
+# (history writer, task processor, dependency prewarm) would not survive the fork.
+# Each worker loads the app itself, after forking.
+
+
+def pre_fork(server, worker):
+    """Runs in the master: hand the scheduler to exactly one live worker."""
+    if not any(getattr(w, "runs_scheduler", False) for w in server.WORKERS.values()):
+        # Replacement workers pick this up again if the owner dies
+        worker.runs_scheduler = True
+
+
+def post_worker_init(worker):
+    """Start background jobs inside the worker, never in the master."""
+    if getattr(worker, "runs_scheduler", False):
+        from modules.tasks import get_scheduler
+        get_scheduler().start()
+
+
+def worker_exit(server, worker):
+    from modules import extensions
+    from modules.tasks import get_scheduler
+    # Only an agent this worker actually built; exiting shouldn't construct one
+    if extensions.agent:
+        extensions.agent.shutdown()
+    if getattr(worker, "runs_scheduler", False):
+        get_scheduler().stop()
@@ -2,20 +2,27 @@
 Action execution cache for pre_request actions.
 Implements stale-while-revalidate pattern to reduce latency.
 """
-import os
-import json
 import time
 import threading
 from typing import Dict, Optional, Any
 
+SHARD_COUNT = 16          # power of two so the shard is a mask of the hash
+REAP_INTERVAL = 60        # seconds between sweeps for expired entries
+REAP_AGE_FACTOR = 4       # entries older than ttl * factor are dropped
+
 class ActionCache:
     """Singleton cache for pre_request action results."""
     
     _instance = None
     
     def __init__(self):
-        self._cache: Dict[str, Dict] = {}  # key -> {data, timestamp, ttl}
-        self._lock = threading.Lock()
+        # key -> {data, timestamp, ttl}, split so users don't contend on one lock
+        self._shards = [dict() for _ in range(SHARD_COUNT)]
+        self._locks = [threading.Lock() for _ in range(SHARD_COUNT)]
+        # user_id -> set of keys, sharded by user so clear_user needn't scan everything
+        self._user_keys = [dict() for _ in range(SHARD_COUNT)]
+        self._user_locks = [threading.Lock() for _ in range(SHARD_COUNT)]
+        self._last_reap = time.monotonic()
     
     @classmethod
     def get_instance(cls):
@@ -26,6 +33,26 @@ class ActionCache:
     def _make_key(self, action_name: str, user_id: str) -> str:
         """Create unique cache key."""
         return f"{action_name}:{user_id}"
+
+    def _shard(self, key: str):
+        """Return the (dict, lock) pair that owns a key."""
+        idx = hash(key) & (SHARD_COUNT - 1)
+        return self._shards[idx], self._locks[idx]
+
+    def _user_shard(self, user_id: str):
+        """Return the (index, lock) pair that tracks a user's keys."""
+        idx = hash(user_id) & (SHARD_COUNT - 1)
+        return self._user_keys[idx], self._user_locks[idx]
+
+    def _forget_key(self, user_id: str, key: str):
+        """Drop a key from the user index."""
+        index, lock = self._user_shard(user_id)
+        with lock:
+            keys = index.get(user_id)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del index[user_id]
     
     def get(self, action_name: str, user_id: str, ttl: int = 0) -> Optional[Dict]:
         """
@@ -43,15 +70,17 @@ class ActionCache:
             return None
         
         key = self._make_key(action_name, user_id)
+        shard, _ = self._shard(key)
+        
+        # Reads are lock-free: a single dict.get is atomic and entries are
+        # replaced wholesale, never mutated in place
+        entry = shard.get(key)
+        if not entry:
+            return None
         
-        with self._lock:
-            entry = self._cache.get(key)
-            if not entry:
-                return None
-            
-            age = time.time() - entry["timestamp"]
-            if age < ttl:
-                return entry["data"]
+        age = time.monotonic() - entry["timestamp"]
+        if age < ttl:
+            return entry["data"]
         
         return None
     
@@ -61,25 +90,25 @@ class ActionCache:
         Returns data even if TTL expired (will be refreshed in background).
         """
         key = self._make_key(action_name, user_id)
+        shard, _ = self._shard(key)
         
-        with self._lock:
-            entry = self._cache.get(key)
-            if entry:
-                return entry["data"]
+        entry = shard.get(key)
+        if entry:
+            return entry["data"]
         
         return None
     
     def is_stale(self, action_name: str, user_id: str, ttl: int) -> bool:
         """Check if cache entry is stale (past TTL)."""
         key = self._make_key(action_name, user_id)
+        shard, _ = self._shard(key)
+        
+        entry = shard.get(key)
+        if not entry:
+            return True  # No entry = stale
         
-        with self._lock:
-            entry = self._cache.get(key)
-            if not entry:
-                return True  # No entry = stale
-            
-            age = time.time() - entry["timestamp"]
-            return age >= ttl
+        age = time.monotonic() - entry["timestamp"]
+        return age >= ttl
     
     def set(self, action_name: str, user_id: str, data: Any, ttl: int = 0):
         """Store result in cache."""
@@ -87,28 +116,57 @@ class ActionCache:
             return
         
         key = self._make_key(action_name, user_id)
+        shard, lock = self._shard(key)
+        now = time.monotonic()
         
-        with self._lock:
-            self._cache[key] = {
+        # Writes keep the shard lock so reap() and clear_user() never see a
+        # shard resized mid-iteration
+        with lock:
+            shard[key] = {
                 "data": data,
-                "timestamp": time.time(),
-                "ttl": ttl
+                "timestamp": now,
+                "ttl": ttl,
+                "user": str(user_id)
             }
+
+        index, index_lock = self._user_shard(str(user_id))
+        with index_lock:
+            index.setdefault(str(user_id), set()).add(key)
+        
+        if now - self._last_reap >= REAP_INTERVAL:
+            self._last_reap = now
+            self.reap()
     
     def invalidate(self, action_name: str, user_id: str):
         """Remove an entry from cache."""
         key = self._make_key(action_name, user_id)
+        shard, lock = self._shard(key)
         
-        with self._lock:
-            if key in self._cache:
-                del self._cache[key]
+        with lock:
+            shard.pop(key, None)
+        self._forget_key(str(user_id), key)
     
     def clear_user(self, user_id: str):
         """Clear all cache entries for a user."""
-        with self._lock:
-            keys_to_remove = [k for k in self._cache if k.endswith(f":{user_id}")]
-            for key in keys_to_remove:
-                del self._cache[key]
+        index, index_lock = self._user_shard(str(user_id))
+        with index_lock:
+            keys = index.pop(str(user_id), ())
+        for key in keys:
+            shard, lock = self._shard(key)
+            with lock:
+                shard.pop(key, None)
+    
+    def reap(self):
+        """Drop entries far past their TTL so the cache doesn't grow unbounded."""
+        now = time.monotonic()
+        for shard, lock in zip(self._shards, self._locks):
+            with lock:
+                expired = [(k, e["user"]) for k, e in shard.items()
+                           if now - e["timestamp"] > e["ttl"] * REAP_AGE_FACTOR]
+                for key, _ in expired:
+                    del shard[key]
+            for key, user_id in expired:
+                self._forget_key(user_id, key)
 
 
 def get_action_cache() -> ActionCache:
@@ -1,17 +1,92 @@
 import os
-import json
 import subprocess
 import sys
 import logging
 import venv
 import threading
-from typing import Dict, Any, Optional, List
+import hashlib
+import importlib.util
+from contextlib import contextmanager
+from types import ModuleType
+from typing import Dict, Any, Optional, List, Tuple
+
+from modules import fastjson
+
+try:
+    import fcntl
+except ImportError:
+    # Windows: no gunicorn there, so a single process does all installs
+    fcntl = None
+
+# Host script that keeps "python_worker" plugins loaded between calls
+WORKER_HOST_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "worker_host.py")
+WORKER_RESULT_KEY = "__worker_result__"
+WORKER_ERROR_KEY = "__worker_error__"
+# Max persistent workers per plugin script; extra concurrent calls wait for one
+WORKER_POOL_SIZE = 2
+# Variables that change per call and are forwarded with each request
+WORKER_ENV_KEYS = ("GENESIS_HOME", "GENESIS_PLUGIN_PATH", "GENESIS_EXECUTION_ID", "ACTION_ARGS")
+# Largest args payload also exported as ACTION_ARGS
+ENV_ARGS_MAX_CHARS = 8192
+# Wheels built for one plugin venv are reused by the next one that needs them
+PIP_CACHE_DIR = os.path.join("bot_data", "_system", "pip_cache")
+# Marks a plugin whose requirements were installed into the shared site
+SHARED_MARKER = ".deps_shared"
+# One shared base venv per Python version plus a --target overlay per plugin
+VENV_ROOT = os.path.join("bot_data", "_system", "venvs")
+
+def _venv_python(venv_path: str) -> str:
+    """Path to the python executable inside a venv."""
+    if os.name == 'nt':
+        return os.path.join(venv_path, "Scripts", "python.exe")
+    return os.path.join(venv_path, "bin", "python")
+
+def _base_venv_path() -> str:
+    """Shared base venv for the running Python version."""
+    return os.path.abspath(os.path.join(VENV_ROOT, f"base-py{sys.version_info.major}.{sys.version_info.minor}"))
+
+def _shared_site_path() -> str:
+    """--target dir holding the merged requirements of plugins prewarmed together."""
+    return os.path.abspath(os.path.join(VENV_ROOT, f"shared-py{sys.version_info.major}.{sys.version_info.minor}"))
+
+def _plugin_overlay_path(plugin_path: str) -> str:
+    """Per-plugin dependency overlay; lives outside the plugin folder so it never touches its files."""
+    plugin_abs = os.path.abspath(plugin_path)
+    overlay_name = f"{os.path.basename(plugin_abs)}-{hashlib.md5(plugin_abs.encode()).hexdigest()[:8]}"
+    return os.path.abspath(os.path.join(VENV_ROOT, "plugins", overlay_name))
+
+def _read_requirements(requirements_path: str) -> Optional[List[str]]:
+    """Requirement specs from a requirements.txt, or None if it uses pip options that can't be merged."""
+    specs = []
+    with open(requirements_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.split(" #", 1)[0].strip()
+            if not line or line.startswith("#"):
+                continue
+            if line.startswith("-"):
+                return None  # -r/-e/--index-url etc. stay per-plugin
+            specs.append(line)
+    return specs
 
 class ActionExecutor:
+    # script_path -> (mtime_ns, module) for python_inproc plugins
+    _inproc_cache: Dict[str, Tuple[int, ModuleType]] = {}
+
     def __init__(self):
         self.logger = logging.getLogger("ActionExecutor")
         self.active_processes = {} # map execution_id -> process
         self.active_processes_lock = threading.Lock()
+        self._workers: Dict[tuple, Dict] = {} # (python_exe, script_path) -> worker pool
+        self._workers_lock = threading.Lock()
+        self._venv_lock = threading.Lock()
+        self.reload_env()
+
+    def reload_env(self):
+        """Re-snapshot os.environ; call after changing the server's environment."""
+        # os.environ.copy() decodes every entry; a plain dict copy per call is much cheaper
+        self._base_env = os.environ.copy()
+        # Plugins emit UTF-8 JSON (orjson writes raw bytes), so pin the pipe encoding
+        self._base_env["PYTHONIOENCODING"] = "utf-8"
 
     def cancel_action(self, execution_id: str):
         """Cancels a running action by its execution_id."""
@@ -33,54 +108,194 @@ class ActionExecutor:
                 self.logger.warning(f"Attempted to cancel unknown execution_id: {execution_id}")
                 return False
 
-    def _ensure_plugin_venv(self, plugin_path: str) -> Optional[str]:
+    def _ensure_base_venv(self, pip_env: Dict) -> Optional[str]:
         """
-        Checks if plugin has requirements.txt. If so, ensures venv exists
-        and dependencies are installed. Returns path to venv python executable.
+        Creates the shared base venv for this Python version (once) and returns
+        its python executable. Plugin dependencies live in per-plugin overlays.
+        """
+        base_path = _base_venv_path()
+        base_python = _venv_python(base_path)
+        ready_marker = os.path.join(base_path, ".base_ready")
+        
+        if os.path.exists(ready_marker):
+            return base_python
+        
+        self.logger.info(f"Creating shared plugin venv at {base_path}")
+        try:
+            venv.EnvBuilder(with_pip=True, symlinks=(os.name != 'nt'), clear=True).create(base_path)
+        except Exception as e:
+            self.logger.error(f"Failed to create venv: {e}")
+            return None
+        
+        # Without wheel, sdists are built in place and never land in the cache
+        try:
+            subprocess.run(
+                [base_python, "-m", "pip", "install", "-q", "wheel"],
+                check=True,
+                capture_output=True,
+                env=pip_env,
+                timeout=120
+            )
+        except Exception as e:
+            self.logger.warning(f"Could not install wheel into plugin venv: {e}")
+        
+        with open(ready_marker, 'w') as f:
+            f.write("ready")
+        return base_python
+
+    def _ensure_plugin_venv(self, plugin_path: str) -> Optional[Tuple[str, str]]:
+        """
+        Checks if plugin has requirements.txt. If so, ensures the shared base venv
+        exists and the plugin's dependencies are installed into its own overlay.
+        Returns (python executable, overlay dir for PYTHONPATH).
         """
         requirements_path = os.path.join(plugin_path, "requirements.txt")
-        venv_path = os.path.join(plugin_path, ".venv")
         
         if not os.path.exists(requirements_path):
             return None  # No special requirements, use system Python
         
-        # Check if venv already exists
-        if os.name == 'nt':
-            venv_python = os.path.join(venv_path, "Scripts", "python.exe")
-        else:
-            venv_python = os.path.join(venv_path, "bin", "python")
+        overlay_path = _plugin_overlay_path(plugin_path)
+        installed_marker = os.path.join(overlay_path, ".deps_installed")
         
-        installed_marker = os.path.join(venv_path, ".deps_installed")
+        if os.path.exists(installed_marker):
+            base_python = _venv_python(_base_venv_path())
+            return base_python, overlay_path
+        if os.path.exists(os.path.join(overlay_path, SHARED_MARKER)):
+            # Installed by prewarm_dependencies() into the shared site
+            return _venv_python(_base_venv_path()), _shared_site_path()
         
-        if not os.path.exists(venv_python):
-            self.logger.info(f"Creating venv for plugin at {plugin_path}")
-            try:
-                venv.create(venv_path, with_pip=True)
-            except Exception as e:
-                self.logger.error(f"Failed to create venv: {e}")
+        pip_env = self._pip_env()
+        
+        # Serialize setup so concurrent first calls don't build the same venv twice
+        with self._install_lock():
+            base_python = self._ensure_base_venv(pip_env)
+            if base_python is None:
                 return None
+            
+            if not os.path.exists(installed_marker):
+                self.logger.info(f"Installing dependencies for plugin at {plugin_path}")
+                try:
+                    subprocess.run(
+                        [base_python, "-m", "pip", "install", "-q", "--prefer-binary",
+                         "--cache-dir", pip_env["PIP_CACHE_DIR"],
+                         "--target", overlay_path, "--upgrade", "-r", requirements_path],
+                        check=True,
+                        capture_output=True,
+                        env=pip_env,
+                        timeout=120  # 2 min timeout for pip
+                    )
+                    # Create marker file
+                    with open(installed_marker, 'w') as f:
+                        f.write("installed")
+                except subprocess.CalledProcessError as e:
+                    self.logger.error(f"Failed to install dependencies: {e.stderr}")
+                    return None
+                except Exception as e:
+                    self.logger.error(f"Failed to install dependencies: {e}")
+                    return None
         
-        # Install dependencies if not already done
-        if not os.path.exists(installed_marker):
-            self.logger.info(f"Installing dependencies for plugin at {plugin_path}")
+        return base_python, overlay_path
+
+    @contextmanager
+    def _install_lock(self):
+        """
+        Serializes venv/pip work between threads and, on POSIX, between processes:
+        each gunicorn worker has its own executor but they share VENV_ROOT.
+        """
+        with self._venv_lock:
+            if fcntl is None:
+                yield
+                return
+            os.makedirs(VENV_ROOT, exist_ok=True)
+            with open(os.path.join(VENV_ROOT, ".install.lock"), "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _pip_env(self) -> Dict:
+        pip_env = self._base_env.copy()
+        pip_env["PIP_CACHE_DIR"] = os.path.abspath(PIP_CACHE_DIR)
+        pip_env["PIP_DISABLE_PIP_VERSION_CHECK"] = "1"
+        return pip_env
+
+    def prewarm_dependencies(self, plugin_paths: List[str]) -> int:
+        """
+        Installs the requirements of all not-yet-installed plugins with one pip
+        run into the shared site, so the resolver and downloads are paid once.
+        Plugins that can't be merged (pip options, or a resolver conflict) keep
+        the lazy per-plugin overlay. Returns how many plugins were installed.
+        """
+        shared_site = _shared_site_path()
+        merged, pending = [], []  # merged specs (deduped, in order); plugins newly sharing them
+        for plugin_path in plugin_paths:
+            requirements_path = os.path.join(plugin_path, "requirements.txt")
+            overlay_path = _plugin_overlay_path(plugin_path)
+            if not os.path.exists(requirements_path) or os.path.exists(os.path.join(overlay_path, ".deps_installed")):
+                continue
+            try:
+                specs = _read_requirements(requirements_path)
+            except OSError:
+                continue
+            if specs is None:
+                continue
+            # Plugins already in the shared site stay in the merge so a re-install keeps them resolvable
+            if not os.path.exists(os.path.join(overlay_path, SHARED_MARKER)):
+                pending.append(overlay_path)
+            merged.extend(spec for spec in specs if spec not in merged)
+
+        if not pending:
+            return 0
+
+        pip_env = self._pip_env()
+        with self._install_lock():
+            # Another worker process may have installed them while we waited
+            pending = [p for p in pending if not os.path.exists(os.path.join(p, SHARED_MARKER))]
+            if not pending:
+                return 0
+            base_python = self._ensure_base_venv(pip_env)
+            if base_python is None:
+                return 0
+
+            os.makedirs(shared_site, exist_ok=True)
+            merged_path = os.path.join(shared_site, ".merged-requirements.txt")
+            with open(merged_path, 'w', encoding='utf-8') as f:
+                f.write("\n".join(merged) + "\n")
+
+            self.logger.info(f"Prewarming dependencies for {len(pending)} plugins ({len(merged)} requirements)")
             try:
                 subprocess.run(
-                    [venv_python, "-m", "pip", "install", "-r", requirements_path, "-q"],
+                    [base_python, "-m", "pip", "install", "-q", "--prefer-binary",
+                     "--cache-dir", pip_env["PIP_CACHE_DIR"],
+                     "--target", shared_site, "--upgrade", "-r", merged_path],
                     check=True,
                     capture_output=True,
-                    timeout=120  # 2 min timeout for pip
+                    env=pip_env,
+                    timeout=600
                 )
-                # Create marker file
-                with open(installed_marker, 'w') as f:
-                    f.write("installed")
             except subprocess.CalledProcessError as e:
-                self.logger.error(f"Failed to install dependencies: {e.stderr}")
-                return None
+                # Usually conflicting pins; each plugin falls back to its own overlay on first use
+                self.logger.warning(f"Shared dependency install failed, using per-plugin installs: {e.stderr}")
+                return 0
             except Exception as e:
-                self.logger.error(f"Failed to install dependencies: {e}")
-                return None
-        
-        return venv_python
+                self.logger.warning(f"Shared dependency install failed, using per-plugin installs: {e}")
+                return 0
+
+            for overlay_path in pending:
+                os.makedirs(overlay_path, exist_ok=True)
+                with open(os.path.join(overlay_path, SHARED_MARKER), 'w') as f:
+                    f.write(shared_site)
+        return len(pending)
+
+    def _resolve_python(self, plugin_path: str, env: Dict) -> str:
+        """Picks the interpreter for a plugin and puts its dependency overlay on PYTHONPATH."""
+        plugin_venv = self._ensure_plugin_venv(plugin_path)
+        if not plugin_venv:
+            return sys.executable
+        python_exe, overlay_path = plugin_venv
+        env["PYTHONPATH"] = os.pathsep.join(p for p in (overlay_path, env.get("PYTHONPATH")) if p)
+        return python_exe
 
     def execute(self, action_def: Dict, args: Dict, context: Dict, progress_callback=None) -> Dict:
         """
@@ -100,7 +315,7 @@ class ActionExecutor:
         role = action_def["role"]
         
         # 1. Setup Environment
-        env = os.environ.copy()
+        env = self._base_env.copy()
         
         # Determine GENESIS_HOME based on role and user
         user_id = context.get("user_id")
@@ -118,8 +333,12 @@ class ActionExecutor:
         env["GENESIS_PLUGIN_PATH"] = plugin_path
         
         # Pass arguments as JSON string
-        args_json = json.dumps(args)
-        env["ACTION_ARGS"] = args_json
+        # Serialized once here and reused for ACTION_ARGS and stdin
+        args_json = fastjson.dumps(args)
+        # stdin always carries the args; large payloads stay out of the environment,
+        # which is size-limited (Windows caps the whole block at 32K chars)
+        if len(args_json) <= ENV_ARGS_MAX_CHARS:
+            env["ACTION_ARGS"] = args_json
         
         # New: Pass Execution ID for process tracking
         if "execution_id" in context:
@@ -130,9 +349,11 @@ class ActionExecutor:
         try:
             if action_type == "python":
                 # Check for plugin-specific venv
-                venv_python = self._ensure_plugin_venv(plugin_path)
-                python_exe = venv_python if venv_python else sys.executable
-                return self._execute_python_internal(script_path, args, env, python_exe, progress_callback)
+                python_exe = self._resolve_python(plugin_path, env)
+                return self._execute_python_internal(script_path, args_json, env, python_exe, progress_callback)
+            elif action_type == "python_worker":
+                python_exe = self._resolve_python(plugin_path, env)
+                return self._execute_python_worker(script_path, args, context, env, python_exe, progress_callback)
             elif action_type == "python_inproc":
                  return self._execute_python_inproc(script_path, args, context) # In-proc needs update too?
             elif action_type == "process":
@@ -150,16 +371,15 @@ class ActionExecutor:
         This allows caching of heavy resources (like ML models) in global variables.
         WARNING: Plugin crashes can crash the main server.
         """
-        import importlib.util
-        import hashlib
-        
         try:
-            # Generate a consistent module name based on path
-            module_name = "plugin_" + hashlib.md5(script_path.encode()).hexdigest()
-            
-            if module_name in sys.modules:
-                module = sys.modules[module_name]
+            # Reuse the loaded module until the file changes on disk
+            mtime_ns = os.stat(script_path).st_mtime_ns
+            entry = self._inproc_cache.get(script_path)
+            if entry and entry[0] == mtime_ns:
+                module = entry[1]
             else:
+                # Consistent module name based on path, only computed on (re)load
+                module_name = "plugin_" + hashlib.md5(script_path.encode()).hexdigest()
                 spec = importlib.util.spec_from_file_location(module_name, script_path)
                 if spec is None:
                      return {"status": "error", "error": f"Could not load spec for {script_path}"}
@@ -167,6 +387,7 @@ class ActionExecutor:
                 module = importlib.util.module_from_spec(spec)
                 sys.modules[module_name] = module
                 spec.loader.exec_module(module)
+                self._inproc_cache[script_path] = (mtime_ns, module)
             
             # Check for execute function
             if hasattr(module, "execute"):
@@ -181,7 +402,124 @@ class ActionExecutor:
             self.logger.error(f"In-process execution failed: {tb}")
             return {"status": "error", "error": f"In-process execution failed: {str(e)}"}
 
-    def _execute_python_internal(self, script_path: str, args: Dict, env: Dict, python_exe: str = None, progress_callback=None) -> Dict:
+    def _acquire_worker(self, pool: Dict, python_exe: str, script_path: str, env: Dict) -> subprocess.Popen:
+        """Takes an idle live worker from the pool, spawning one if the pool has room."""
+        with pool["cond"]:
+            while True:
+                while pool["idle"]:
+                    process = pool["idle"].pop()
+                    if process.poll() is None:
+                        return process
+                    # Died while idle (crash or cancel); its slot is free again
+                    self.logger.warning(f"Worker for {script_path} exited ({process.returncode}), respawning")
+                    pool["size"] -= 1
+                if pool["size"] < WORKER_POOL_SIZE:
+                    pool["size"] += 1
+                    break
+                pool["cond"].wait()
+
+        try:
+            # Same spawn constraints as _run_subprocess (vfork-eligible)
+            return subprocess.Popen(
+                [python_exe, "-u", WORKER_HOST_SCRIPT, script_path],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                env=env,
+                cwd=env.get("GENESIS_PLUGIN_PATH", os.getcwd())
+            )
+        except Exception:
+            self._release_worker(pool, None)
+            raise
+
+    def _release_worker(self, pool: Dict, process: Optional[subprocess.Popen]):
+        """Returns a worker to the pool, or frees its slot if it is gone."""
+        with pool["cond"]:
+            if process is not None and process.poll() is None and not pool["closed"]:
+                pool["idle"].append(process)
+            else:
+                pool["size"] -= 1
+                if process is not None and process.poll() is None:
+                    process.kill()
+            pool["cond"].notify()
+
+    def _execute_python_worker(self, script_path: str, args: Dict, context: Dict, env: Dict, python_exe: str, progress_callback=None) -> Dict:
+        """
+        Executes a plugin's execute(args, context) in a persistent worker process.
+        Each plugin has a small pool so concurrent calls don't queue behind one
+        another; workers are spawned on demand and replaced if they exit.
+        """
+        key = (python_exe, script_path)
+        with self._workers_lock:
+            pool = self._workers.get(key)
+            if pool is None:
+                pool = {"idle": [], "size": 0, "closed": False, "cond": threading.Condition()}
+                self._workers[key] = pool
+
+        execution_id = env.get("GENESIS_EXECUTION_ID")
+
+        # A worker serves one request at a time; the pipe protocol is strictly request/response
+        process = self._acquire_worker(pool, python_exe, script_path, env)
+        if execution_id:
+            with self.active_processes_lock:
+                self.active_processes[execution_id] = process
+
+        try:
+            request = {
+                "args": args,
+                "context": context,
+                "env": {k: env.get(k) for k in WORKER_ENV_KEYS}
+            }
+            process.stdin.write(fastjson.dumps_bytes(request) + b"\n")
+            process.stdin.flush()
+
+            for line in process.stdout:
+                line = line.strip()
+                if not line.startswith(b"{"):
+                    continue
+                try:
+                    data = fastjson.loads(line)
+                except ValueError:
+                    continue
+
+                if WORKER_RESULT_KEY in data:
+                    return {"status": "success", "output": data[WORKER_RESULT_KEY]}
+                if WORKER_ERROR_KEY in data:
+                    return {"status": "error", "error": data[WORKER_ERROR_KEY]}
+                if progress_callback and data.get("status") in ["progress", "match"]:
+                    progress_callback(data)
+
+            # EOF before a result frame: the worker crashed or was cancelled
+            return_code = process.wait()
+            return {"status": "error", "error": f"Worker exited with code {return_code}", "exit_code": return_code}
+        except OSError as e:
+            # Broken pipe - worker died between calls; its slot is freed on release
+            return {"status": "error", "error": f"Worker unavailable: {e}"}
+        finally:
+            if execution_id:
+                with self.active_processes_lock:
+                    self.active_processes.pop(execution_id, None)
+            self._release_worker(pool, process)
+
+    def shutdown_workers(self):
+        """Stops every persistent plugin worker."""
+        with self._workers_lock:
+            pools = list(self._workers.values())
+            self._workers.clear()
+
+        for pool in pools:
+            with pool["cond"]:
+                pool["closed"] = True
+                idle, pool["idle"] = pool["idle"], []
+                pool["size"] -= len(idle)
+            for process in idle:
+                try:
+                    # Closing stdin ends the host's read loop; kill if it lingers
+                    process.stdin.close()
+                    process.wait(timeout=2)
+                except Exception:
+                    process.kill()
+
+    def _execute_python_internal(self, script_path: str, args_json: str, env: Dict, python_exe: str = None, progress_callback=None) -> Dict:
         """
         Executes a python script as a subprocess.
         Uses provided python_exe (from venv) or falls back to sys.executable.
@@ -189,7 +527,7 @@ class ActionExecutor:
         if python_exe is None:
             python_exe = sys.executable
         cmd = [python_exe, script_path]
-        return self._run_subprocess(cmd, args_json=json.dumps(args), env=env, progress_callback=progress_callback)
+        return self._run_subprocess(cmd, args_json=args_json, env=env, progress_callback=progress_callback)
 
     def _execute_process(self, script_path: str, args_json: str, env: Dict, progress_callback=None) -> Dict:
         """Executes an arbitrary executable."""
@@ -200,6 +538,10 @@ class ActionExecutor:
         execution_id = env.get("GENESIS_EXECUTION_ID")
         
         try:
+            # Keep spawn options to cwd/env/pipes: with no preexec_fn, start_new_session
+            # or user/group switches, CPython 3.10+ uses vfork on Linux, so the child does
+            # not copy the server's page tables. (os.posix_spawn is skipped whenever cwd
+            # is set, and plugins rely on running from their own folder.)
             process = subprocess.Popen(
                 cmd,
                 stdin=subprocess.PIPE,
@@ -207,6 +549,8 @@ class ActionExecutor:
                 stderr=subprocess.PIPE,
                 env=env,
                 text=True,
+                encoding="utf-8",
+                errors="replace",
                 cwd=env.get("GENESIS_PLUGIN_PATH", os.getcwd()),
                 bufsize=1 # Line buffered
             )
@@ -215,36 +559,43 @@ class ActionExecutor:
                 with self.active_processes_lock:
                     self.active_processes[execution_id] = process
             
-            # Send input
-            if args_json:
-                process.stdin.write(args_json)
+            # Drain stderr concurrently so a chatty plugin can't fill the pipe and
+            # deadlock against our stdout reads. (selectors can't wait on pipes on Windows.)
+            stderr_chunks = []
+            stderr_thread = threading.Thread(target=lambda: stderr_chunks.append(process.stderr.read()), daemon=True)
+            stderr_thread.start()
+            
+            # Send input; always close so plugins reading stdin see EOF
+            try:
+                if args_json:
+                    process.stdin.write(args_json)
                 process.stdin.close()
+            except OSError:
+                pass  # Plugin exited without reading its input
             
             stdout_lines = []
             
-            # Read stdout line by line
-            while True:
-                line = process.stdout.readline()
-                if not line:
-                    if process.poll() is not None:
-                        break
-                    continue
-                
+            # Read stdout line by line; blocks until a line or EOF, no polling
+            last_result = None
+            for line in process.stdout:
                 stdout_lines.append(line)
                 
-                # Check for progress
-                if progress_callback and line.strip().startswith("{"):
+                # Each JSON line is parsed once: progress goes to the UI, anything
+                # else is remembered as the latest result candidate
+                if line.lstrip().startswith("{"):
                     try:
-                        data = json.loads(line)
-                        if data.get("status") in ["progress", "match"]:
+                        data = fastjson.loads(line)
+                    except ValueError:
+                        continue
+                    if data.get("status") in ["progress", "match"]:
+                        if progress_callback:
                             progress_callback(data)
-                    except:
-                        pass
-            
-            # Capture stderr
-            stderr_output = process.stderr.read()
+                    else:
+                        last_result = data
             
             return_code = process.wait()
+            stderr_thread.join()
+            stderr_output = "".join(stderr_chunks)
             full_stdout = "".join(stdout_lines)
             
             # Cleanup registration
@@ -257,32 +608,18 @@ class ActionExecutor:
             # Or if we just want to return whatever we got.
             
             if return_code == 0:
-                try:
-                    # Try to find the last JSON line as the result
-                    # Or parse the whole thing if it's one JSON
-                    output_data = None
-                    for line in reversed(stdout_lines):
-                        if line.strip().startswith("{"):
-                            try:
-                                candidate = json.loads(line)
-                                if candidate.get("status") not in ["progress", "match"]:
-                                    output_data = candidate
-                                    break
-                            except:
-                                continue
+                # The last non-progress JSON line is the result
+                output_data = last_result
+                
+                if not output_data and full_stdout.lstrip()[:1] in ("{", "["):
+                    # Maybe it is just one big (multi-line) JSON
+                    try:
+                        output_data = fastjson.loads(full_stdout)
+                    except ValueError:
+                        # Not JSON after all - return it as text
+                        pass
                     
-                    if not output_data:
-                        # Maybe it is just one big JSON
-                        try:
-                            output_data = json.loads(full_stdout)
-                        except:
-                            # If we can't parse it, and we have lines, maybe it's just text
-                            # check if we had matches during progress
-                            pass
-                        
-                    return {"status": "success", "output": output_data if output_data else full_stdout}
-                except json.JSONDecodeError:
-                    return {"status": "success", "output": full_stdout}
+                return {"status": "success", "output": output_data if output_data else full_stdout}
             else:
                 # Even if error/cancelled, return partial output if useful
                 return {"status": "error", "error": stderr_output or f"Process exited with code {return_code}", "exit_code": return_code, "partial_output": full_stdout}
@@ -1,9 +1,17 @@
 import os
-import json
 import logging
 import hashlib
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Tuple
 import shutil
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from modules import fastjson
+
+REQUIRED_MANIFEST_FIELDS = frozenset({"id", "name", "version", "actions"})
+MAX_SCAN_WORKERS = 32
+# A directory whose listing is unchanged is not re-walked more often than this
+SCAN_RECHECK_SECONDS = 5.0
 
 class ActionRegistry:
     _instance = None
@@ -13,6 +21,14 @@ class ActionRegistry:
         self.plugins = {}  # Map[plugin_id, plugin_metadata]
         self.system_plugin_dir = os.path.join("data", "plugins")
         self.logger = logging.getLogger("ActionRegistry")
+        # manifest_path -> (mtime_ns, manifest, action records); skips re-parsing unchanged plugins
+        self._scan_cache: Dict[str, Tuple[int, Dict, Dict]] = {}
+        # directory -> (mtime_ns, monotonic scan time, [(manifest, records)]) from its last walk
+        self._dir_scans: Dict[str, Tuple[int, float, List[Tuple[Dict, Dict]]]] = {}
+        # trigger -> {action_name: metadata}; rebuilt lazily after self.actions changes
+        self._by_trigger: Optional[Dict[str, Dict]] = None
+        # Bumped whenever self.actions changes; lets callers cache anything derived from it
+        self.version = 0
 
     @classmethod
     def get_instance(cls):
@@ -32,55 +48,126 @@ class ActionRegistry:
                 self._scan_dir(user_plugin_dir, role="user")
 
     def _scan_dir(self, directory: str, role: str):
-        if not os.path.exists(directory):
+        try:
+            dir_mtime = os.stat(directory).st_mtime_ns
+        except OSError:
             return
 
+        # 0. No plugin folder added/removed and walked moments ago: reuse that walk.
+        # (Edits inside a plugin folder don't touch this mtime, hence the time bound.)
+        now = time.monotonic()
+        last = self._dir_scans.get(directory)
+        if last and last[0] == dir_mtime and now - last[1] < SCAN_RECHECK_SECONDS:
+            for manifest, records in last[2]:
+                self.plugins[manifest["id"]] = manifest
+                self._add_records(records)
+            return
+
+        # 1. One scandir pass: re-register unchanged plugins, collect the rest
+        found = []  # (manifest, records) registered from this directory
+        pending = []  # (entry, manifest_path, mtime_ns)
         for entry in os.scandir(directory):
-            if entry.is_dir():
+            # Dot-dirs include in-progress .gplug extractions (see unpack_plugin)
+            if entry.is_dir() and not entry.name.startswith('.'):
                 manifest_path = os.path.join(entry.path, "manifest.json")
-                if os.path.exists(manifest_path):
-                    try:
-                        with open(manifest_path, 'r') as f:
-                            manifest = json.load(f)
-                        
-                        if self._validate_manifest(manifest):
-                            plugin_id = manifest.get("id")
-                            manifest["_path"] = entry.path
-                            manifest["_role"] = role
-                            self.plugins[plugin_id] = manifest
-                            self._register_actions_from_manifest(manifest)
-                            self.logger.info(f"Loaded plugin: {plugin_id} ({role})")
-                        else:
-                            self.logger.warning(f"Invalid manifest in {entry.path}")
-
-                    except Exception as e:
-                        self.logger.error(f"Error loading plugin {entry.name}: {e}")
+                try:
+                    mtime_ns = os.stat(manifest_path).st_mtime_ns
+                except OSError:
+                    continue
+
+                cached = self._scan_cache.get(manifest_path)
+                if cached and cached[0] == mtime_ns and cached[1]["_role"] == role:
+                    # Unchanged since last scan: re-register the prepared records
+                    manifest, records = cached[1], cached[2]
+                    self.plugins[manifest["id"]] = manifest
+                    self._add_records(records)
+                    found.append((manifest, records))
+                    continue
+
+                pending.append((entry, manifest_path, mtime_ns))
+
+        if not pending:
+            self._dir_scans[directory] = (dir_mtime, now, found)
+            return
+
+        # 2. Read/parse manifests concurrently (file reads release the GIL)
+        if len(pending) == 1:
+            loaded = [self._load_manifest(pending[0][1])]
+        else:
+            with ThreadPoolExecutor(max_workers=min(MAX_SCAN_WORKERS, len(pending))) as pool:
+                loaded = list(pool.map(self._load_manifest, [p[1] for p in pending]))
+
+        # 3. Register on this thread so the registry dicts are only mutated here
+        for (entry, manifest_path, mtime_ns), (manifest, error) in zip(pending, loaded):
+            if error is not None:
+                self.logger.error(f"Error loading plugin {entry.name}: {error}")
+            elif self._validate_manifest(manifest):
+                plugin_id = manifest.get("id")
+                manifest["_path"] = entry.path
+                manifest["_role"] = role
+                self.plugins[plugin_id] = manifest
+                records = self._register_actions_from_manifest(manifest)
+                self._scan_cache[manifest_path] = (mtime_ns, manifest, records)
+                found.append((manifest, records))
+                self.logger.info(f"Loaded plugin: {plugin_id} ({role})")
+            else:
+                self.logger.warning(f"Invalid manifest in {entry.path}")
+
+        self._dir_scans[directory] = (dir_mtime, now, found)
+
+    @staticmethod
+    def _load_manifest(manifest_path: str) -> Tuple[Optional[Dict], Optional[Exception]]:
+        """Reads one manifest; runs on the scan pool, so it must not touch registry state."""
+        try:
+            return fastjson.load_file(manifest_path), None
+        except Exception as e:
+            return None, e
 
     def _validate_manifest(self, manifest: Dict) -> bool:
-        required_fields = ["id", "name", "version", "actions"]
-        for field in required_fields:
-            if field not in manifest:
-                return False
-        return True
+        # Shape checks that registration relies on; anything else is read with .get()
+        return (
+            isinstance(manifest, dict)
+            and REQUIRED_MANIFEST_FIELDS.issubset(manifest)
+            and isinstance(manifest["id"], str)
+            and isinstance(manifest["actions"], list)
+            and all(isinstance(action, dict) for action in manifest["actions"])
+        )
 
-    def _register_actions_from_manifest(self, manifest: Dict):
+    def _register_actions_from_manifest(self, manifest: Dict) -> Dict:
+        """Registers the manifest's actions and returns the records that were added."""
         plugin_id = manifest["id"]
         role = manifest["_role"]
         path = manifest["_path"]
+        abs_path = os.path.abspath(path)
+        records = {}
         
         for action in manifest.get("actions", []):
             action_name = action.get("name")
             if action_name:
                 # Store full metadata needed for execution
-                self.actions[action_name] = {
+                records[action_name] = {
                     "plugin_id": plugin_id,
                     "role": role,
-                    "path": os.path.abspath(path),
+                    "path": abs_path,
                     "spec": action,  # The action definition from manifest
-                    "script": os.path.abspath(os.path.join(path, action.get("script", "main.py"))),
+                    "script": os.path.join(abs_path, action.get("script", "main.py")),
                     "cache_ttl": action.get("cache_ttl", 0),  # 0 = no caching
                     "trigger": action.get("trigger", "manual")  # manual, pre_request, post_request
                 }
+        
+        self._add_records(records)
+        return records
+
+    def _add_records(self, records: Dict):
+        for action_name, record in records.items():
+            # Rescans re-add the same record objects; only a real change drops the index
+            if self.actions.get(action_name) is not record:
+                self.actions[action_name] = record
+                self._actions_changed()
+
+    def _actions_changed(self):
+        self._by_trigger = None
+        self.version += 1
 
     def get_action(self, action_name: str) -> Optional[Dict]:
         return self.actions.get(action_name)
@@ -88,6 +175,22 @@ class ActionRegistry:
     def get_all_actions(self) -> Dict:
         return self.actions
 
+    def get_actions_by_trigger(self, trigger: str) -> Dict:
+        """Actions with the given trigger (manual, pre_request, post_request), by name."""
+        index = self._by_trigger
+        if index is None:
+            index = {}
+            for action_name, action in list(self.actions.items()):
+                index.setdefault(action.get("trigger", "manual"), {})[action_name] = action
+            self._by_trigger = index
+        return index.get(trigger, {})
+
+    def prewarm_dependencies(self, executor) -> int:
+        """Installs the requirements of every registered plugin in one shared pip run (see ActionExecutor)."""
+        # Snapshot: this usually runs on a background thread while scans keep registering
+        plugin_paths = [p["_path"] for p in list(self.plugins.values()) if p.get("_path")]
+        return executor.prewarm_dependencies(plugin_paths)
+
     def get_plugin(self, plugin_id: str) -> Optional[Dict]:
         """Get plugin metadata by ID."""
         return self.plugins.get(plugin_id)
@@ -118,10 +221,12 @@ class ActionRegistry:
         
         # Unpack with integrity verification
         manifest = unpack_plugin(gplug_path, target_dir, verify=True)
+        manifest['_role'] = scope
         
         # Register the newly installed plugin
         self._register_actions_from_manifest(manifest)
         self.plugins[manifest['id']] = manifest
+        self._dir_scans.pop(target_dir, None)
         
         self.logger.info(f"Installed plugin: {manifest['id']} ({scope})")
         return manifest
@@ -171,6 +276,9 @@ class ActionRegistry:
         ]
         for name in actions_to_remove:
             del self.actions[name]
+        self._actions_changed()
+        # Don't let a recent walk of its directory re-register it
+        self._dir_scans.clear()
         
         self.logger.info(f"Deleted plugin: {plugin_id}")
         return True
@@ -0,0 +1,90 @@
+"""
+Long-lived host process for "python_worker" actions.
+Loads a plugin script once and serves its execute(args, context) over
+newline-delimited JSON, so repeat calls skip interpreter startup and keep
+whatever the plugin caches at module level.
+
+Runs inside the plugin's interpreter (possibly a plugin venv), so it must
+not import anything from the Genesis package.
+
+Usage: python -u worker_host.py <script_path>
+"""
+import os
+import sys
+import json
+import traceback
+import importlib.util
+
+try:
+    import orjson
+
+    def _dumps(obj):
+        return orjson.dumps(obj, default=str)
+    _loads = orjson.loads
+except ImportError:
+    def _dumps(obj):
+        return json.dumps(obj, default=str).encode("utf-8")
+    _loads = json.loads
+
+# Frame keys that mark the end of one request; anything else on stdout is a
+# progress line printed by the plugin and is passed through as-is.
+RESULT_KEY = "__worker_result__"
+ERROR_KEY = "__worker_error__"
+
+
+def _load_plugin(script_path: str):
+    spec = importlib.util.spec_from_file_location("genesis_plugin", script_path)
+    if spec is None:
+        raise ImportError(f"Could not load spec for {script_path}")
+    module = importlib.util.module_from_spec(spec)
+    sys.modules["genesis_plugin"] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+def main():
+    if len(sys.argv) < 2:
+        print("Usage: worker_host.py <script_path>", file=sys.stderr)
+        sys.exit(2)
+
+    script_path = sys.argv[1]
+    out = sys.stdout.buffer
+    sys.path.insert(0, os.path.dirname(os.path.abspath(script_path)))
+
+    try:
+        module = _load_plugin(script_path)
+        execute = getattr(module, "execute", None)
+        load_error = None if callable(execute) else "Plugin script missing 'execute(args, context)' function"
+    except Exception as e:
+        traceback.print_exc()
+        load_error = f"Failed to load plugin: {e}"
+
+    for line in sys.stdin.buffer:
+        if not line.strip():
+            continue
+
+        try:
+            request = _loads(line)
+            if load_error:
+                raise RuntimeError(load_error)
+
+            # Per-call environment (GENESIS_HOME differs per user, etc.)
+            for key, value in (request.get("env") or {}).items():
+                if value is None:
+                    os.environ.pop(key, None)
+                else:
+                    os.environ[key] = value
+
+            frame = {RESULT_KEY: execute(request.get("args") or {}, request.get("context") or {})}
+        except Exception as e:
+            traceback.print_exc()
+            frame = {ERROR_KEY: str(e)}
+
+        # Flush the plugin's own prints before the frame so ordering holds
+        sys.stdout.flush()
+        out.write(_dumps(frame) + b"\n")
+        out.flush()
+
+
+if __name__ == "__main__":
+    main()
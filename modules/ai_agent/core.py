@@ -1,21 +1,162 @@
 from .providers.qwen_provider import QwenProvider
 from .providers.gemini_provider import GeminiProvider
+import logging
 import threading
-from concurrent.futures import wait, FIRST_COMPLETED
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from weakref import WeakSet
 import queue
 import datetime
 import psutil
 import os
 import re
 import uuid
-import json
-from modules.config import get_active_model_settings
-from modules.db import save_chat_item, load_chat_items, update_history_entry, get_chat_owner, save_raw_history
+try:
+    import resource
+except ImportError:
+    # Windows: priority classes go through psutil instead
+    resource = None
+from modules import fastjson
+from modules.config import get_active_model_settings, load_settings, load_prompts
+from modules.db import save_chat_item, save_chat_items_bulk, load_chat_items, update_history_entry, get_chat_owner, save_raw_history_bulk, get_user_preferred_model, get_api_key
 from modules.actions.registry import ActionRegistry
 from modules.actions.executor import ActionExecutor
+from modules.actions.cache import get_action_cache
+from modules.utils import StreamingActionParser, extract_json
+from modules.permissions import check_permission, init_permissions_db
+from modules.prompt_builder import format_history_for_prompt, build_system_prompt, ACTION_DATA_SLOT
+from modules.bot_config import get_bot_config
 
 from .utils import GetTokenLength, clean_content, shrink_history
 
+# Action workers are shared by every chat and mostly sit blocked on plugin subprocess
+# I/O, so size the pool like the stdlib's I/O default rather than a fixed handful
+ACTION_WORKERS = min(32, (os.cpu_count() or 1) + 4)
+
+def _can_renice_to(nice):
+    """Whether this process may lower a thread's niceness back to `nice` (root, or within RLIMIT_NICE)."""
+    if os.geteuid() == 0:
+        return True
+    try:
+        limit = resource.getrlimit(resource.RLIMIT_NICE)[0]
+    except (AttributeError, OSError, ValueError):
+        return False
+    return limit == resource.RLIM_INFINITY or nice >= 20 - limit
+
+# Debug traces of the request/action flow; silent unless DEBUG is enabled for this logger
+logger = logging.getLogger("AIAgent")
+
+# Action wait-loop event producers, bound per action with partial()
+def _put_progress(events_q, name, data):
+    events_q.put(("progress", {"name": name, "data": data}))
+
+def _put_done(events_q, future):
+    events_q.put(("done", future))
+
+def _format_observation(exec_result):
+    """
+    Text of an action result for the prompt, chat log and UI.
+    Text outputs pass through as-is (serializing them would only quote and escape
+    them); structured outputs are serialized once.
+    """
+    output_val = exec_result.get("output", {})
+    if exec_result["status"] == "success":
+        # Smart Output Unwrap
+        if isinstance(output_val, str):
+            return output_val
+        if isinstance(output_val, dict) and len(output_val) == 1 and "output" in output_val and isinstance(output_val["output"], str):
+            return output_val["output"]
+        return fastjson.dumps(output_val)
+    
+    obs = f"Error: {exec_result.get('error')}"
+    # Check for partial output
+    if "partial_output" in exec_result:
+        obs += f"\n[Partial Output]: {exec_result['partial_output']}"
+    return obs
+
+def _progress_frames(msg, events_q, chat_id):
+    """
+    Yields the stream frames for a progress message. Progress already queued behind it
+    is folded in, so a chatty action produces one content frame per drain instead of
+    one per callback. Returns the first non-progress event taken off the queue, or None.
+    """
+    lines = []
+    while True:
+        status_msg = ""
+        # Parse known progress fields
+        if "scanned" in msg["data"]:
+            status_msg = f"Scanned {msg['data']['scanned']} items..."
+        elif "message" in msg["data"]:
+            status_msg = msg["data"]["message"]
+        
+        if status_msg:
+            lines.append(f"[{msg['name']} Progress]: {status_msg}\n")
+        
+        # Handle Action Update (Match Found); keep it in order with the text around it
+        if "status" in msg["data"] and msg["data"]["status"] == "match":
+            if lines:
+                yield {"status": "content", "chunk": "".join(lines), "chat_id": chat_id}
+                lines = []
+            yield {
+                "status": "action_update",
+                "type": "match",
+                "data": msg["data"],
+                "chat_id": chat_id
+            }
+        
+        try:
+            event = events_q.get_nowait()
+        except queue.Empty:
+            event = None
+        if event is None or event[0] != "progress":
+            break
+        msg = event[1]
+    
+    if lines:
+        # Yield progress chunk directly to chat stream
+        yield {"status": "content", "chunk": "".join(lines), "chat_id": chat_id}
+    return event
+
+class _EntryWriter:
+    """
+    Coalesces the streaming loop's updates to its chat_items entry: the entry only
+    needs the latest content/thinking, so at most one UPDATE per FLUSH_INTERVAL.
+    content/thinking may be given as a list of parts that is still being appended
+    to; it is joined only when a write happens.
+    """
+    FLUSH_INTERVAL = 0.15  # seconds
+    
+    def __init__(self, entry_id):
+        self.entry_id = entry_id
+        self._content = None
+        self._thinking = None
+        self._last_flush = 0.0
+    
+    def update(self, content=None, thinking=None, thinking_suffix=""):
+        if content is not None:
+            self._content = content
+        if thinking is not None:
+            self._thinking = (thinking, thinking_suffix)
+        if time.monotonic() - self._last_flush >= self.FLUSH_INTERVAL:
+            self.flush()
+    
+    def flush(self):
+        if self.entry_id and (self._content is not None or self._thinking is not None):
+            content = self._content
+            if isinstance(content, list):
+                content = "".join(content)
+            thinking = None
+            if self._thinking is not None:
+                thinking, suffix = self._thinking
+                if isinstance(thinking, list):
+                    thinking = "".join(thinking)
+                thinking += suffix
+            update_history_entry(self.entry_id, content=content, thinking=thinking)
+        self._content = self._thinking = None
+        self._last_flush = time.monotonic()
+
 class AIAgent:
     def __init__(self, **kwargs):
         self.model_cfg = get_active_model_settings()
@@ -25,13 +166,106 @@ class AIAgent:
         # Provider Cache: model_id -> provider_instance
         self.providers = {}
         
+        self.priority_map = {
+            "low": psutil.IDLE_PRIORITY_CLASS if os.name == 'nt' else 19,
+            "normal": psutil.NORMAL_PRIORITY_CLASS if os.name == 'nt' else 0,
+            "high": psutil.HIGH_PRIORITY_CLASS if os.name == 'nt' else -10
+        }
+        # Handle to this process for Windows priority classes (Process() opens a handle)
+        self._proc = psutil.Process(os.getpid())
+        self.stop_event = threading.Event()
+        self.request_queue = queue.Queue()
+        
+        # Action System Initialization
+        self.action_registry = ActionRegistry.get_instance()
+        self.action_registry.scan_plugins() # Load system plugins
+        self.action_executor = ActionExecutor()
+        # One pip run for every plugin's requirements instead of one per plugin on first use
+        threading.Thread(
+            target=self.action_registry.prewarm_dependencies,
+            args=(self.action_executor,),
+            name="DependencyPrewarm",
+            daemon=True
+        ).start()
+        
+        # EXECUTOR for Parallel Actions (created on first use, see thread_pool)
+        self._thread_pool = None
+        self._thread_pool_lock = threading.Lock()
+
+        # Track active tasks for resubscription: chat_id -> set of subscriber queues.
+        # Weak, so a disconnected stream's queue drops out without explicit cleanup.
+        self.active_tasks = defaultdict(WeakSet)
+        self.active_tasks_lock = threading.Lock()
+        
+        # Track Active Execution IDs for Cancellation: chat_id -> execution_id
+        self.active_action_ids = {} 
+        self.active_action_ids_lock = threading.Lock()
+        
+        # Permission checks run on every action round; create their table once up front
+        init_permissions_db()
+        
+        self.processor_thread = threading.Thread(target=self._main_processor, daemon=True)
+        self.processor_thread.start()
+
+        # Raw history logging runs off the streaming path: ask_stream only enqueues.
+        # The writer is started by _log_queue() in whichever process logs first.
+        self._log_q = None
+        self._log_thread = None
+        self._log_pid = None
+        self._log_lock = threading.Lock()
+
+    @property
+    def thread_pool(self) -> ThreadPoolExecutor:
+        """Action pool; built lazily so chats that never run an action don't start it."""
+        if self._thread_pool is None:
+            with self._thread_pool_lock:
+                if self._thread_pool is None:
+                    self._thread_pool = ThreadPoolExecutor(max_workers=ACTION_WORKERS, thread_name_prefix="ActionWorker")
+        return self._thread_pool
+
+    def _set_priority(self, value):
+        """
+        Sets the priority of the calling thread (niceness on POSIX) or, on Windows,
+        the process priority class. Returns the previous value, or None if nothing
+        changed, so a request at the current priority (usually "normal") sets nothing.
+        A lower priority is skipped when this thread couldn't raise it back afterwards.
+        """
+        try:
+            if os.name == 'nt':
+                previous = self._proc.nice()
+                if previous != value:
+                    self._proc.nice(value)
+                    return previous
+            else:
+                # Per-thread on Linux, so concurrent requests don't renice each other
+                tid = threading.get_native_id()
+                previous = os.getpriority(os.PRIO_PROCESS, tid)
+                if previous != value:
+                    if value > previous and not _can_renice_to(previous):
+                        # Request threads are reused; this one would stay low for every later request
+                        return None
+                    os.setpriority(os.PRIO_PROCESS, tid, value)
+                    return previous
+        except (OSError, psutil.Error):
+            # Raising priority needs privileges we may lack; the request runs as-is
+            pass
+        return None
+
+    def _restore_priority(self, value):
+        """Undoes _set_priority for the calling thread (or the process, on Windows)."""
+        try:
+            if os.name == 'nt':
+                self._proc.nice(value)
+            else:
+                os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), value)
+        except (OSError, psutil.Error) as e:
+            logger.warning("Could not restore priority %s: %s", value, e)
+        
     def _get_provider(self, model_id=None):
         """
         Retrieves or instantiates a provider for the given model_id.
         If model_id is None, uses the global default from settings.
         """
-        from modules.config import get_active_model_settings, load_settings
-        
         # 1. Resolve Model Configuration
         target_cfg = None
         settings = load_settings()
@@ -79,42 +313,6 @@ class AIAgent:
         # Legacy property for backward compatibility, returns default active
         return self._get_provider()
 
-    def __init__(self, **kwargs):
-        self.model_cfg = get_active_model_settings()
-        self.providers = {} 
-        
-        # Legacy: Check for specific forced init
-        # if self.model_cfg:
-        #      self._get_provider(self.model_cfg["id"])
-        
-        self.priority_map = {
-            "low": psutil.IDLE_PRIORITY_CLASS if os.name == 'nt' else 19,
-            "normal": psutil.NORMAL_PRIORITY_CLASS if os.name == 'nt' else 0,
-            "high": psutil.HIGH_PRIORITY_CLASS if os.name == 'nt' else -10
-        }
-        self.stop_event = threading.Event()
-        self.request_queue = queue.Queue()
-        
-        # Action System Initialization
-        self.action_registry = ActionRegistry.get_instance()
-        self.action_registry.scan_plugins() # Load system plugins
-        self.action_executor = ActionExecutor()
-        
-        # EXECUTOR for Parallel Actions
-        from concurrent.futures import ThreadPoolExecutor
-        self.thread_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="ActionWorker")
-
-        # Track active tasks for resubscription: chat_id -> list of queues
-        self.active_tasks = {}
-        self.active_tasks_lock = threading.Lock()
-        
-        # Track Active Execution IDs for Cancellation: chat_id -> execution_id
-        self.active_action_ids = {} 
-        self.active_action_ids_lock = threading.Lock()
-        
-        self.processor_thread = threading.Thread(target=self._main_processor, daemon=True)
-        self.processor_thread.start()
-
     def cancel_current_action(self, chat_id):
         """Cancels the currently running action for a specific chat."""
         with self.active_action_ids_lock:
@@ -125,12 +323,55 @@ class AIAgent:
 
     def _broadcast(self, chat_id, data):
         with self.active_tasks_lock:
-            if chat_id in self.active_tasks:
-                for q in self.active_tasks[chat_id]:
-                    try:
-                        q.put(data)
-                    except:
-                        pass
+            # .get(): don't create an entry for chats nobody subscribed to
+            for q in self.active_tasks.get(chat_id, ()):
+                try:
+                    q.put_nowait(data)
+                except:
+                    pass
+
+    def _log_raw_history(self, chat_id, data):
+        """Queues a raw history entry for the log worker."""
+        context = data.get("history_context")
+        if context:
+            # Snapshot: the live history keeps changing after this returns
+            data["history_context"] = [dict(m) for m in context]
+        self._log_queue().put_nowait((chat_id, data))
+
+    def _log_queue(self):
+        """
+        Returns the HistoryLog queue, starting its writer thread if this process has
+        no live one. A forked child (e.g. a gunicorn worker) inherits the agent but
+        not its threads, so this is checked per pid rather than once in __init__.
+        """
+        pid = os.getpid()
+        if self._log_pid == pid and self._log_thread.is_alive():
+            return self._log_q
+        with self._log_lock:
+            if self._log_pid != pid:
+                # Entries queued before a fork are the parent's to write
+                self._log_q = queue.Queue()
+                self._log_pid = pid
+            elif self._log_thread.is_alive():
+                return self._log_q
+            self._log_thread = threading.Thread(target=self._log_worker, args=(self._log_q,), name="HistoryLog", daemon=True)
+            self._log_thread.start()
+        return self._log_q
+
+    def _log_worker(self, log_q):
+        """Writes queued raw history entries, everything waiting at once in one transaction."""
+        while True:
+            entry = log_q.get()
+            batch = []
+            while entry is not None:
+                batch.append(entry)
+                try:
+                    entry = log_q.get_nowait()
+                except queue.Empty:
+                    break
+            save_raw_history_bulk(batch)
+            if entry is None:
+                return
 
     def _main_processor(self):
         """
@@ -155,12 +396,6 @@ class AIAgent:
              chat_id = f"ephemeral_{uuid.uuid4().hex[:8]}"
 
         # Load System Prompt if not provided or empty
-        from modules.config import load_prompts
-        if not system_prompt:
-             prompts = load_prompts()
-             system_prompt = prompts.get(prompt_id, "")
-
-
         if not system_prompt:
              prompts = load_prompts()
              system_prompt = prompts.get(prompt_id, "")
@@ -172,20 +407,8 @@ class AIAgent:
         # Try to get User's preferred model
         preferred_model = None
         if user_id:
-            from modules.db import init_db # Ensure db
-            import sqlite3
-            # We need a direct DB read here. 
-            # Ideally this should be a helper in db.py: get_user_preference(user_id)
             try:
-                base_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-                db_path = os.path.join(base_dir, "data", "system.db")
-                conn = sqlite3.connect(db_path)
-                cursor = conn.cursor()
-                cursor.execute("SELECT preferred_model FROM users WHERE id = ?", (user_id,))
-                row = cursor.fetchone()
-                conn.close()
-                if row and row[0]:
-                    preferred_model = row[0]
+                preferred_model = get_user_preferred_model(user_id)
             except Exception as e:
                 print(f"[Core] Error fetching user preference: {e}")
 
@@ -205,10 +428,8 @@ class AIAgent:
              }
              
              # Polling Loop (Wait for Key)
-             import time
              for _ in range(60): # Wait 60 seconds max
                  time.sleep(1)
-                 from modules.db import get_api_key
                  if get_api_key("gemini"):
                      current_provider.api_key = get_api_key("gemini")
                      import google.generativeai as genai
@@ -220,16 +441,8 @@ class AIAgent:
                  yield {"status": "error", "error": "Timed out waiting for API Key."}
                  return
         
-        # Priority Handling
-        p = psutil.Process(os.getpid())
-        original_priority = p.nice()
-        try:
-            if os.name == 'nt':
-                 p.nice(self.priority_map.get(priority.lower(), psutil.NORMAL_PRIORITY_CLASS))
-            else:
-                p.nice(self.priority_map.get(priority.lower(), 0))
-        except:
-            pass
+        # Priority Handling (None when already at the requested priority)
+        original_priority = self._set_priority(self.priority_map.get(priority.lower(), self.priority_map["normal"]))
 
         # ENTRY SAVING LOGIC
         db_entry_id = None
@@ -240,15 +453,14 @@ class AIAgent:
                  save_chat_item(chat_id, "user", prompt)
         except Exception as e:
             print(f"[Error:History] Failed to save chat items for {chat_id}: {e}")
+        # Streamed content/thinking goes to the entry through this (coalesced writes)
+        entry_writer = _EntryWriter(db_entry_id)
 
         try:
             # --- ACTION LOOP START ---
             max_loops = 5
             current_loop = 0
             
-            # Helper Import
-            from modules.prompt_builder import format_history_for_prompt, build_system_prompt
-            
             # Prepare History
             if history_override:
                 loop_history = history_override.copy()
@@ -262,28 +474,53 @@ class AIAgent:
             
             pre_request_outputs = []
             
-            # Execute all actions with trigger="pre_request"
-            for act_name, act_meta in all_actions.items():
-                if act_meta.get("trigger") == "pre_request":
-                    try:
-                        # Execute silently
-                        ctx = {"user_id": user_id, "chat_id": chat_id}
-                        print(f"[Core] Running pre-request action: {act_name}", flush=True)
+            # Execute all actions with trigger="pre_request". They are mostly I/O bound,
+            # so all but the first go to the pool and the first runs on this thread;
+            # latency is the slowest action rather than the sum. Actions whose manifest
+            # sets cache_ttl reuse their last output for that many seconds.
+            ctx = {"user_id": user_id, "chat_id": chat_id}
+            pre_request_actions = list(self.action_registry.get_actions_by_trigger("pre_request").items())
+            action_cache = get_action_cache()
+            pre_request_cached = {}
+            for act_name, act_meta in pre_request_actions:
+                hit = action_cache.get(act_name, user_id, act_meta.get("cache_ttl") or 0)
+                # Entries hold the record they came from; a re-registered plugin gets a new one
+                if hit and hit[0] is act_meta:
+                    pre_request_cached[act_name] = hit[1]
+            to_run = [(act_name, act_meta) for act_name, act_meta in pre_request_actions if act_name not in pre_request_cached]
+            pre_request_futures = {
+                act_name: self.thread_pool.submit(self.action_executor.execute, act_meta, {}, ctx)
+                for act_name, act_meta in to_run[1:]
+            }
+            
+            # Outputs keep registration order so the system prompt is stable between requests
+            for act_name, act_meta in pre_request_actions:
+                if act_name in pre_request_cached:
+                    pre_request_outputs.append(f"### {act_name}\n{pre_request_cached[act_name]}")
+                    continue
+                try:
+                    # Execute silently
+                    print(f"[Core] Running pre-request action: {act_name}", flush=True)
+                    if act_name in pre_request_futures:
+                        res = pre_request_futures[act_name].result()
+                    else:
                         res = self.action_executor.execute(act_meta, {}, ctx)
-                        if res["status"] == "success":
-                            output_str = json.dumps(res["output"], indent=2) if isinstance(res["output"], (dict, list)) else str(res["output"])
-                            
-                            # [DEBUG:Action]
-                            print(f"[DEBUG:Action] Pre-request '{act_name}' returned: {output_str}", flush=True)
+                    if res["status"] == "success":
+                        # Compact JSON: this goes into the system prompt, where indentation only costs tokens
+                        out = res["output"]
+                        output_str = out if isinstance(out, str) else fastjson.dumps(out)
+                        
+                        # [DEBUG:Action]
+                        logger.debug("[DEBUG:Action] Pre-request '%s' returned: %s", act_name, output_str)
 
-                            pre_request_outputs.append(f"### {act_name}\n{output_str}")
-                    except Exception as e:
-                        print(f"[Core] Pre-request action {act_name} failed: {e}")
+                        pre_request_outputs.append(f"### {act_name}\n{output_str}")
+                        action_cache.set(act_name, user_id, (act_meta, output_str), act_meta.get("cache_ttl") or 0)
+                except Exception as e:
+                    print(f"[Core] Pre-request action {act_name} failed: {e}")
             
             action_data_str = "\n\n".join(pre_request_outputs)
             
             # Build System Prompt
-            from modules.bot_config import get_bot_config
             bot_config = get_bot_config(str(user_id)) if user_id else {"name": "Genesis AI", "personality": ""}
             
             available_actions_list = list(all_actions.values())
@@ -292,36 +529,45 @@ class AIAgent:
                 user_id=user_id,
                 available_actions=available_actions_list,
                 action_data=action_data_str,
-                bot_config=bot_config
+                bot_config=bot_config,
+                actions_key=self.action_registry.version
             )
 
             # Inject system prompt at the beginning of history logic
             loop_history = format_history_for_prompt(loop_history, system_prompt)
+            # Provider view of the history (system prompt goes out-of-band). Holds the same
+            # message dicts; every loop_history append below is mirrored here.
+            non_system_history = [m for m in loop_history if m.get("role") != "system"]
             
             current_prompt = prompt # Default initialization
             json_data = None # Ensure defined for loop scope
             found_resume_actions = [] # Ensure defined for loop scope
             accumulated_thinking = "" # Capture thinking output
+            # action_formater prompt: rendered once per request, observations spliced in per round
+            formater_shell = None
 
             # RESUME LOGIC
             if resume_action:
-                print(f"[DEBUG:Resume] Starting Resume Logic for chat_id={chat_id}", flush=True)
+                logger.debug("[DEBUG:Resume] Starting Resume Logic for chat_id=%s", chat_id)
                 # Scan history for the last action request
                 last_msg = ""
-                if loop_history:
-                     pass
 
+                # Newest-first, so this normally stops within the last few messages
                 for m in reversed(loop_history):
-                     # Skip empty messages
-                     if m.get('role') == 'assistant' and m.get('content', '').strip():
-                         last_msg = m.get('content', '')
+                     if m.get('role') != 'assistant':
+                         continue
+                     content = m.get('content') or ''
+                     # Skip empty messages (isspace() avoids copying the text like strip() would)
+                     if content and not content.isspace():
+                         last_msg = content
                          break
                 
-                print(f"[DEBUG:Resume] Last Msg (First 500 chars): {last_msg[:500]}", flush=True)
+                logger.debug("[DEBUG:Resume] Last Msg (First 500 chars): %s", last_msg[:500])
                 
                 found_resume_actions = []
-                from modules.utils import extract_json
-                json_data = extract_json(last_msg)
+                # Only "action"/"actions" keys are used below, and json needs the quoted
+                # key literally; skip the parse for plain-text replies
+                json_data = extract_json(last_msg) if '"action' in last_msg else None
                 
                 if json_data:
                     # Check for single action object
@@ -339,7 +585,7 @@ class AIAgent:
                             found_resume_actions.extend(acts)
 
                 if found_resume_actions:
-                    print(f"[DEBUG:Resume] Found {len(found_resume_actions)} actions to resume.", flush=True)
+                    logger.debug("[DEBUG:Resume] Found %s actions to resume.", len(found_resume_actions))
                     # We have actions to execute. Jump directly to action execution phase.
                     # We simulate the model having just outputted this.
                     full_content = last_msg
@@ -347,104 +593,12 @@ class AIAgent:
                     # We need to ensure we are in the loop context
                     current_loop = 1 
                 else:
-                     print("[DEBUG:Resume] No actions found to resume.", flush=True)
+                     logger.debug("[DEBUG:Resume] No actions found to resume.")
                      resume_action = False # Fallback to normal generation
 
-            # --- GENERATION LOOP ---
-            while current_loop <= max_loops:
-                full_content = ""
-                # Reset thinking for this turn if we want to capture it freshly, 
-                # OR keep it accumulating? Usually per-turn thinking.
-                # If we accumulate across loops (Action -> Think -> Action), we might want a list?
-                # For now, let's reset it per generation to avoid duplicates.
-                # BUT the variable MUST be available for the += operation.
-                # If I defined it outside, it should be fine.
-                # However, if I define it HERE, it shadows the outer one, which is fine for the loop.
-                # But I need it available for the specific `save_raw_history` at the END of the function.
-                # So I should use a different variable name locally or ensure the outer one is used.
-                # Actually, `accumulated_thinking` at the end wants the LAST thinking? Or all of it?
-                # Probably the last one.
-                pass
-                
-                # If we are NOT resuming, we generate text
-                if not resume_action:
-                    # 1. Prepare Prompt
-                    if current_loop == 0:
-                        prompt_for_model = current_prompt
-                        if not prompt_for_model:
-                             prompt_for_model = "Continue processing based on the previous context."
-                    else:
-                        prompt_for_model = "Continue processing based on the action output."
-
-                    # Ensure variable is ready for +=
-                    if 'accumulated_thinking' not in locals():
-                        accumulated_thinking = ""
-
-                    # 2. History Handling
-                    # History for provider: deeply copy looped history
-                    history_for_provider = [
-                        {"role": m["role"], "content": m["content"]} 
-                        for m in loop_history 
-                        if m.get("role") != "system"
-                    ]
-                    
-                    # Current System Prompt
-                    current_sys_prompt = system_prompt 
-                    
-                    # Generate Response
-                    # Use thinking only if requested AND it's the first loop (or user wants it always?)
-                    # For now, let's respect the flag passed to ask_stream.
-                    # Qwen provider checks if it supports it.
-                    try:
-                        generator = current_provider.generate(
-                            prompt=prompt_for_model, 
-                            use_thinking=use_thinking, 
-                            stop_event=stop_event,
-                            history_override=history_for_provider,
-                            system_prompt=current_sys_prompt
-                        )
-                        
-                        # Stream it
-                        for chunk in generator:
-                            # Check for dict (status update) or string (content)
-                            if isinstance(chunk, dict):
-                                if chunk.get("status") == "thinking":
-                                    accumulated_thinking += chunk.get("chunk", "")
-                                elif chunk.get("status") == "thinking_finished":
-                                    # Ensure we captured everything
-                                    if chunk.get("thinking"): 
-                                        accumulated_thinking = chunk.get("thinking")
-                                
-                                yield chunk
-                            else:
-                                full_content += chunk
-                                yield {
-                                    "status": "stream",
-                                    "content": chunk,
-                                    "chat_id": chat_id
-                                }
-                                
-                    except Exception as e:
-                        print(f"[Core] Generation Error: {e}")
-                        yield {"status": "error", "error": str(e)}
-                        return
-                
-                # Reset resume flag after first pass check
-                resume_action = False
-                
-                # [Optimization] Update History Immediately with Assistant Response
-                # This ensures if we crash or stop, the response is saved.
-                # However, for actions, we might want to append AFTER we confirm? 
-                # No, standard flow is: User -> Assistant (Call) -> Tool (Result) -> Assistant (Answer)
-                
-                if full_content.strip():
-                     loop_history.append({"role": "assistant", "content": full_content})
-                     # Save to DB? We usually save at the end of the turn, but for safety:
-                     # save_chat_item(... assistant ...) - omitting for speed, we save below.
-
-                # --- 3. RESPONSE ANALYSIS & ACTION EXTRACTION ---
-                # ... (Next block handles this)
-                
+            # Resuming after a permission pause: run the approved actions, then let the
+            # generation loop below formulate the answer from their output
+            if resume_action:
                 if json_data and isinstance(json_data, dict) and "actions" in json_data:
                     raw_actions = json_data["actions"]
                     if isinstance(raw_actions, list):
@@ -465,7 +619,7 @@ class AIAgent:
                                     "args": args
                                 })
                 
-                print(f"[DEBUG:Resume] Found {len(found_resume_actions)} actions to resume.", flush=True)
+                logger.debug("[DEBUG:Resume] Found %s actions to resume.", len(found_resume_actions))
                 
                 if found_resume_actions:
                      if db_entry_id: update_history_entry(db_entry_id, thinking=f"[Resuming Actions...]")
@@ -474,16 +628,13 @@ class AIAgent:
                      futures = []
                      future_map = {}
                      pending = []
-                     progress_q = queue.Queue()
-                     
-                     def make_cb(name):
-                         return lambda d: progress_q.put({"name": name, "data": d})
+                     events_q = queue.SimpleQueue()  # ("progress", msg) and ("done", future) events
                      
                      for act in found_resume_actions:
                          action_name = act["name"]
                          try:
                              action_args = act["args"]
-                             print(f"[DEBUG:Resume] preparing action: {action_name} Args: {action_args}", flush=True)
+                             logger.debug("[DEBUG:Resume] preparing action: %s Args: %s", action_name, action_args)
                              
                              action_def = self.action_registry.get_action(action_name)
                              
@@ -495,53 +646,37 @@ class AIAgent:
                                  
                                  ctx = {"user_id": user_id, "chat_id": chat_id, "execution_id": execution_id}
                                  
-                                 f = self.thread_pool.submit(self.action_executor.execute, action_def, action_args, ctx, make_cb(action_name))
+                                 f = self.thread_pool.submit(self.action_executor.execute, action_def, action_args, ctx, partial(_put_progress, events_q, action_name))
                                  future_map[f] = action_name
                                  pending.append(f)
+                                 f.add_done_callback(partial(_put_done, events_q))
                                  
                                  yield {"status": "content", "chunk": f"[Executing {action_name}...]\n", "chat_id": chat_id}
                              else:
-                                 print(f"[DEBUG:Resume] Action definition not found for {action_name}", flush=True)
+                                 logger.debug("[DEBUG:Resume] Action definition not found for %s", action_name)
                          except Exception as e:
-                             print(f"[DEBUG:Resume] Error preparing {action_name}: {e}", flush=True)
+                             logger.debug("[DEBUG:Resume] Error preparing %s: %s", action_name, e)
                              pass
 
                      # Streaming Wait Loop
                      observations = []
+                     action_log = []  # (role, content) rows for save_chat_items_bulk
                      
-                     while pending or not progress_q.empty():
-                         # 1. Drain Queue (Non-blocking)
-                         while not progress_q.empty():
-                             try:
-                                 msg = progress_q.get_nowait()
-                                 status_msg = ""
-                                 # Parse known progress fields
-                                 if "scanned" in msg["data"]:
-                                     status_msg = f"Scanned {msg['data']['scanned']} items..."
-                                 elif "message" in msg["data"]:
-                                     status_msg = msg["data"]["message"]
-                                 
-                                 if status_msg:
-                                    # Yield progress chunk directly to chat stream
-                                    yield {"status": "content", "chunk": f"[{msg['name']} Progress]: {status_msg}\n", "chat_id": chat_id}
-                                 
-                                 # Handle Action Update (Match Found)
-                                 if "status" in msg["data"] and msg["data"]["status"] == "match":
-                                     yield {
-                                         "status": "action_update",
-                                         "type": "match",
-                                         "data": msg["data"],
-                                         "chat_id": chat_id
-                                     }
-                                     
-                             except:
-                                 break
+                     deferred = None  # Event taken off the queue by _progress_frames
+                     while pending:
+                         # 1. Next event: a progress update or a finished action. Progress
+                         # callbacks run inside execute(), so they are queued before its done event.
+                         if deferred is not None:
+                             (kind, item), deferred = deferred, None
+                         else:
+                             kind, item = events_q.get()
+                         if kind == "progress":
+                             # Streams this and any progress queued behind it; hands back the next other event
+                             deferred = yield from _progress_frames(item, events_q, chat_id)
+                             continue
                          
-                         if not pending:
-                             break
-                             
-                         # 2. Wait for Futures
-                         done, not_done = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+                         # 2. Finished action
+                         done = (item,)
                          
                          for future in done:
                              pending.remove(future)
@@ -560,19 +695,15 @@ class AIAgent:
 
                                  try:
                                      exec_result = future.result()
-                                     obs_text = json.dumps(exec_result.get("output", {})) if exec_result["status"] == "success" else f"Error: {exec_result.get('error')}"
+                                     obs_text = _format_observation(exec_result)
                                      
                                      # [DEBUG:Action]
-                                     print(f"[DEBUG:Action] Action '{name}' returned: {obs_text}", flush=True)
+                                     logger.debug("[DEBUG:Action] Action '%s' returned: %s", name, obs_text)
                                      
                                      observations.append(f"Action '{name}' Result: {obs_text}")
                                      
-                                     # Log to Database for History/Web UI
-                                     try:
-                                         # save_chat_item is imported globally
-                                         save_chat_item(chat_id, "system", f"[Action Output: {name}] {obs_text}")
-                                     except Exception as e:
-                                         print(f"[DEBUG:Resume] Failed to log action result: {e}")
+                                     # Logged to the database in one transaction once all actions finish
+                                     action_log.append(("system", f"[Action Output: {name}] {obs_text}"))
                                      
                                      action_status = "success" if exec_result["status"] == "success" else "error"
                                      yield {
@@ -586,17 +717,23 @@ class AIAgent:
                                      observations.append(f"Action '{name}' Failed: {str(e)}")
 
 
+                     # Log to Database for History/Web UI
+                     save_chat_items_bulk(chat_id, action_log)
+
                      # Update System Prompt to "action_formater" mode
                      observations_str = "\n".join(observations)
                      
-                     new_sys_prompt = build_system_prompt(
-                         user_id=user_id,
-                         available_actions=available_actions_list,
-                         action_data=observations_str, 
-                         bot_config=bot_config,
-                         prompt_id="action_formater",
-                         user_message=prompt
-                     )
+                     if formater_shell is None:
+                         formater_shell = build_system_prompt(
+                             user_id=user_id,
+                             available_actions=available_actions_list,
+                             action_data=ACTION_DATA_SLOT,
+                             bot_config=bot_config,
+                             prompt_id="action_formater",
+                             user_message=prompt,
+                             actions_key=self.action_registry.version
+                         )
+                     new_sys_prompt = formater_shell.replace(ACTION_DATA_SLOT, observations_str)
                      
                      # Update System Message in History
                      if loop_history and loop_history[0].get('role') == 'system':
@@ -607,34 +744,30 @@ class AIAgent:
                      # Set current prompt to trigger summary
                      current_prompt = "Actions executed. Please formulate the response."
                      current_loop = 1
-                else:
-                     print(f"[DEBUG:Resume] No actions found to resume!", flush=True)
-                     current_prompt = prompt # Fallback
-            
-
 
-            full_content_raw = ""
-            accumulated_thinking = ""
-            
+            # --- GENERATION LOOP ---
             while current_loop < max_loops:
                 if current_loop > 0:
                     yield {"status": "action_loop", "loop": current_loop + 1, "max_loops": max_loops, "chat_id": chat_id}
                 
-                full_content_raw = ""
-                accumulated_thinking = ""
+                # Streamed text is collected in lists (joined once after the stream): the
+                # entry writer keeps a reference, which would make += copy on every chunk
+                content_parts = []
+                thinking_parts = []
+                thinking_suffix = "\n[Action Processing...]" if current_loop > 0 else ""
                 
-                # Use loop_history which has system prompt + context
-                # history_override is usually None from api
+                # Full context (system prompt included) for the raw history logs
                 active_history = loop_history
                 
                 # Used for System Prompt + Context logging
                 # We log the 'User' side of the raw history here, capturing the full context fed to the model.
                 try:
-                    from modules.db import save_raw_history
+                    # Both entries describe the start of this turn; stamp them once
+                    turn_started = datetime.datetime.now().isoformat()
                     
                     # 1. Log System Prompt (Populated)
-                    save_raw_history(chat_id, {
-                        "timestamp": datetime.datetime.now().isoformat(),
+                    self._log_raw_history(chat_id, {
+                        "timestamp": turn_started,
                         "chat_id": chat_id,
                         "model_config": self.provider.model_cfg if hasattr(self.provider, 'model_cfg') else {},
                         "system_prompt": system_prompt, 
@@ -648,8 +781,8 @@ class AIAgent:
                     })
 
                     # 2. Log User Prompt
-                    save_raw_history(chat_id, {
-                        "timestamp": datetime.datetime.now().isoformat(),
+                    self._log_raw_history(chat_id, {
+                        "timestamp": turn_started,
                         "chat_id": chat_id,
                         "model_config": self.provider.model_cfg if hasattr(self.provider, 'model_cfg') else {},
                         "system_prompt": system_prompt, 
@@ -664,49 +797,61 @@ class AIAgent:
                 except Exception as log_err:
                      print(f"[Core] User/System History Logging Failed: {log_err}")
 
-                # Provider Generate
+                # Provider Generate (system prompt goes out-of-band, so pass the non-system view)
                 count = 0
-                for result in self.provider.generate(current_prompt, use_thinking=use_thinking, stop_event=stop_event or self.stop_event, return_json=return_json, parent_id=chat_id, history_override=active_history, system_prompt=system_prompt):
+                action_parser = StreamingActionParser()
+                for result in current_provider.generate(current_prompt, use_thinking=use_thinking, stop_event=stop_event or self.stop_event, return_json=return_json, parent_id=chat_id, history_override=non_system_history, system_prompt=system_prompt):
                     result['chat_id'] = chat_id
                     count += 1
                     
                     if result.get("status") == "thinking":
                         chunk = result.get("chunk", "")
                         if chunk:
-                            accumulated_thinking += chunk
-                            if db_entry_id: update_history_entry(db_entry_id, thinking=accumulated_thinking + ("\n[Action Processing...]" if current_loop > 0 else ""))
+                            thinking_parts.append(chunk)
+                            entry_writer.update(thinking=thinking_parts, thinking_suffix=thinking_suffix)
                             yield result
                     
                     elif result.get("status") == "thinking_finished":
                         if result.get("thinking"):
-                            accumulated_thinking = result.get("thinking", "")
-                        if db_entry_id: update_history_entry(db_entry_id, thinking=accumulated_thinking)
+                            thinking_parts = [result.get("thinking", "")]
+                        entry_writer.update(thinking=thinking_parts)
+                        entry_writer.flush()
                         yield result
 
                     else:
                         if result.get("status") == "content" or result.get("status") == "json_content":
                             chunk = result.get("chunk", "")
                             if result.get("status") == "json_content" and "raw" in result:
-                                full_content_raw = result["raw"]
+                                content_parts = [result["raw"]]
+                                # Whole reply replaced: parse it afresh
+                                action_parser = StreamingActionParser()
+                                action_parser.feed(result["raw"])
                             else:
-                                full_content_raw += chunk
+                                content_parts.append(chunk)
+                                action_parser.feed(chunk)
                             
-                            if db_entry_id: update_history_entry(db_entry_id, content=full_content_raw)
-                            yield result
+                            entry_writer.update(content=content_parts)
                             yield result
+                # The stream is complete: write whatever is still pending
+                entry_writer.flush()
+                full_content_raw = "".join(content_parts)
+                accumulated_thinking = "".join(thinking_parts)
                 
-                # --- DETECT ACTIONS (PARALLEL) ---
                 # --- DETECT ACTIONS (JSON) ---
-                from modules.utils import extract_json
-                
                 found_actions = []
-                json_data = extract_json(full_content_raw)
+                # Collected while streaming; re-extract only when the parser couldn't follow a reply
+                # that does contain an object (plain-text replies skip extract_json entirely)
+                raw_actions = action_parser.actions
+                json_data = None  # The reply's JSON object, when it had to be extracted
+                if not raw_actions and action_parser.saw_object:
+                    json_data = extract_json(full_content_raw)
+                    if json_data and isinstance(json_data, dict) and "actions" in json_data:
+                        raw_actions = json_data["actions"]
                 
-                print(f"[DEBUG:Core] AI Response Content: {full_content_raw[:200]}...", flush=True)
+                logger.debug("[DEBUG:Core] AI Response Content: %s...", full_content_raw[:200])
                 
-                if json_data and isinstance(json_data, dict) and "actions" in json_data:
-                    raw_actions = json_data["actions"]
-                    print(f"[DEBUG:Core] Extracted JSON Actions: {raw_actions}", flush=True)
+                if raw_actions:
+                    logger.debug("[DEBUG:Core] Extracted JSON Actions: %s", raw_actions)
                     
                     if isinstance(raw_actions, list):
                         for ra in raw_actions:
@@ -739,18 +884,7 @@ class AIAgent:
 
                     yield {"status": "content", "chunk": f"\n\n[System] Executing {len(found_actions)} actions...\n", "chat_id": chat_id}
                     
-                    # CHECK PERMISSIONS
-                    from modules.permissions import check_permission, init_permissions_db
-                    init_permissions_db()
-                    
-                    
-                    # CHECK PERMISSIONS
-                    from modules.permissions import check_permission, init_permissions_db
-                    init_permissions_db()
-                    
-                    # DB functions are already imported globally
-
-                    
+                    # CHECK PERMISSIONS (table created once in __init__)
                     paused = False
                     for act in found_actions:
                         action_name = act["name"]
@@ -762,21 +896,20 @@ class AIAgent:
                                 "chat_id": chat_id
                             }
                             paused = True
-                            print(f"[DEBUG:Core] Permission required for {action_name}", flush=True)
+                            logger.debug("[DEBUG:Core] Permission required for %s", action_name)
                             break # Only one permission request at a time
                     
                     if paused:
                         # Force update the chat_item with the full content we have so far
                         if db_entry_id:
-                            print(f"[DEBUG:Core] Perm Pause: Updating DB Entry {db_entry_id} with {len(full_content_raw)} chars", flush=True)
+                            logger.debug("[DEBUG:Core] Perm Pause: Updating DB Entry %s with %s chars", db_entry_id, len(full_content_raw))
                             update_history_entry(db_entry_id, content=full_content_raw)
                         
                         # Ensure we save the history before exiting, so Resume can find the action request!
                         # The incremental update_history_entry handles the chat display, but let's be safe.
-                        print(f"[DEBUG:Core] Pausing for Permission. Saving history...", flush=True)
+                        logger.debug("[DEBUG:Core] Pausing for Permission. Saving history...")
                         try:
-                            # save_raw_history is imported globally now
-                            save_raw_history(chat_id, {
+                            self._log_raw_history(chat_id, {
                                 "timestamp": datetime.datetime.now().isoformat(),
                                 "chat_id": chat_id,
                                 "model_config": self.provider.model_cfg if hasattr(self.provider, 'model_cfg') else {},
@@ -798,16 +931,13 @@ class AIAgent:
                     futures = []
                     future_map = {}
                     pending = []
-                    progress_q = queue.Queue()
-                    
-                    def make_cb(name):
-                        return lambda d: progress_q.put({"name": name, "data": d})
+                    events_q = queue.SimpleQueue()  # ("progress", msg) and ("done", future) events
                     
                     for act in found_actions:
                         action_name = act["name"]
                         action_args = act["args"]
                         try:
-                            print(f"[DEBUG:Core] Executing Action: {action_name} Args: {action_args}", flush=True)
+                            logger.debug("[DEBUG:Core] Executing Action: %s Args: %s", action_name, action_args)
                             action_def = self.action_registry.get_action(action_name)
                             if action_def:
                                 # Generate and Track Execution ID
@@ -817,47 +947,33 @@ class AIAgent:
                                 
                                 ctx = {"user_id": user_id, "chat_id": chat_id, "execution_id": execution_id}
                                 
-                                f = self.thread_pool.submit(self.action_executor.execute, action_def, action_args, ctx, make_cb(action_name))
+                                f = self.thread_pool.submit(self.action_executor.execute, action_def, action_args, ctx, partial(_put_progress, events_q, action_name))
                                 future_map[f] = action_name
                                 pending.append(f)
+                                f.add_done_callback(partial(_put_done, events_q))
                             else:
-                                print(f"[DEBUG:Core] Action {action_name} not found in registry", flush=True)
+                                logger.debug("[DEBUG:Core] Action %s not found in registry", action_name)
                         except Exception as e:
-                            print(f"[DEBUG:Core] Error preparing action {action_name}: {e}", flush=True)
+                            logger.debug("[DEBUG:Core] Error preparing action %s: %s", action_name, e)
 
                     # Streaming Wait Loop (Main)
-                    while pending or not progress_q.empty():
-                         # 1. Drain Queue (Non-blocking)
-                         while not progress_q.empty():
-                             try:
-                                 msg = progress_q.get_nowait()
-                                 status_msg = ""
-                                 # Parse known progress fields
-                                 if "scanned" in msg["data"]:
-                                     status_msg = f"Scanned {msg['data']['scanned']} items..."
-                                 elif "message" in msg["data"]:
-                                     status_msg = msg["data"]["message"]
-                                 
-                                 if status_msg:
-                                    # Yield progress chunk directly to chat stream
-                                    yield {"status": "content", "chunk": f"[{msg['name']} Progress]: {status_msg}\n", "chat_id": chat_id}
-                                 
-                                 # Handle Action Update (Match Found)
-                                 if "status" in msg["data"] and msg["data"]["status"] == "match":
-                                     yield {
-                                         "status": "action_update",
-                                         "type": "match",
-                                         "data": msg["data"],
-                                         "chat_id": chat_id
-                                     }
-                             except:
-                                 break
+                    observations = []
+                    action_log = []  # (role, content) rows for save_chat_items_bulk
+                    deferred = None  # Event taken off the queue by _progress_frames
+                    while pending:
+                         # 1. Next event: a progress update or a finished action. Progress
+                         # callbacks run inside execute(), so they are queued before its done event.
+                         if deferred is not None:
+                             (kind, item), deferred = deferred, None
+                         else:
+                             kind, item = events_q.get()
+                         if kind == "progress":
+                             # Streams this and any progress queued behind it; hands back the next other event
+                             deferred = yield from _progress_frames(item, events_q, chat_id)
+                             continue
                          
-                         if not pending:
-                             break
-                             
-                         # 2. Wait for Futures
-                         done, not_done = wait(pending, timeout=0.1, return_when=FIRST_COMPLETED)
+                         # 2. Finished action
+                         done = (item,)
                          
                          for future in done:
                              pending.remove(future)
@@ -872,32 +988,15 @@ class AIAgent:
                                  try:
                                      exec_result = future.result()
                                      
-                                     # Smart Output Unwrap
-                                     output_val = exec_result.get("output", {})
-                                     if exec_result["status"] == "success":
-                                         if isinstance(output_val, str):
-                                             obs = output_val
-                                         elif isinstance(output_val, dict) and len(output_val) == 1 and "output" in output_val and isinstance(output_val["output"], str):
-                                             obs = output_val["output"]
-                                         else:
-                                             obs = json.dumps(output_val)
-                                     else:
-                                         obs = f"Error: {exec_result.get('error')}"
-                                         # Check for partial output
-                                         if "partial_output" in exec_result:
-                                              obs += f"\n[Partial Output]: {exec_result['partial_output']}"
+                                     obs = _format_observation(exec_result)
                                      
                                      # [DEBUG:Action]
-                                     print(f"[DEBUG:Action] Action '{name}' returned: {obs}", flush=True)
+                                     logger.debug("[DEBUG:Action] Action '%s' returned: %s", name, obs)
       
                                      observations.append(f"Action '{name}' Result: {obs}")
                                      
-                                     # Log to Database for History/Web UI
-                                     try:
-                                         # save_chat_item is imported globally
-                                         save_chat_item(chat_id, "system", f"[Action Output: {name}] {obs}")
-                                     except Exception as e:
-                                         print(f"[DEBUG:Core] Failed to log action result: {e}")
+                                     # Logged to the database in one transaction once all actions finish
+                                     action_log.append(("system", f"[Action Output: {name}] {obs}"))
                                      
                                      action_status = "success" if exec_result["status"] == "success" else "error"
                                      yield {
@@ -913,41 +1012,54 @@ class AIAgent:
 
 
 
+                    # Log to Database for History/Web UI
+                    save_chat_items_bulk(chat_id, action_log)
+
                     # Prepare Action Data for System Prompt
                     observations_str = "\n".join(observations)
                     
                     # Switch to "action_formater" System Prompt
-                    new_sys_prompt = build_system_prompt(
-                         user_id=user_id,
-                         available_actions=available_actions_list,
-                         action_data=observations_str, 
-                         bot_config=bot_config,
-                         prompt_id="action_formater",
-                         user_message=prompt
-                    )
+                    if formater_shell is None:
+                        formater_shell = build_system_prompt(
+                            user_id=user_id,
+                            available_actions=available_actions_list,
+                            action_data=ACTION_DATA_SLOT,
+                            bot_config=bot_config,
+                            prompt_id="action_formater",
+                            user_message=prompt,
+                            actions_key=self.action_registry.version
+                        )
+                    new_sys_prompt = formater_shell.replace(ACTION_DATA_SLOT, observations_str)
                      
                     # Update System Message in History Loop
                     if loop_history and loop_history[0].get('role') == 'system':
                          loop_history[0]['content'] = new_sys_prompt
+                    # The provider takes the system prompt out-of-band, so this is what it sees
+                    system_prompt = new_sys_prompt
 
                     # Commit the previous turn to history
                     if current_loop == 0:
-                        loop_history.append({"role": "user", "content": prompt or "Action Request"}) 
-                    loop_history.append({"role": "assistant", "content": full_content_raw})
+                        user_msg = {"role": "user", "content": prompt or "Action Request"}
+                        loop_history.append(user_msg)
+                        non_system_history.append(user_msg)
+                    assistant_msg = {"role": "assistant", "content": full_content_raw}
+                    loop_history.append(assistant_msg)
+                    non_system_history.append(assistant_msg)
                     
                     # Set trigger for next generation
                     current_prompt = "Actions executed. Please formulate the response."
                         
                     current_loop += 1
                     continue
-                else:
-                    break # No valid actions 
                 
                 # NO ACTIONS FOUND - Final Response Analysis
                 # If we are expecting JSON, and we have a full buffer, let's try to parse it.
                 if return_json and (current_loop == max_loops or not found_actions):
-                    from modules.utils import extract_json
-                    parsed = extract_json(full_content_raw)
+                    # Reuse the detection pass: it extracted the object unless the parser had
+                    # streamed actions (none of them usable, since we got here)
+                    if json_data is None and raw_actions:
+                        json_data = extract_json(full_content_raw)
+                    parsed = json_data if isinstance(json_data, dict) else None
                     
                     if parsed:
                         yield {
@@ -968,12 +1080,10 @@ class AIAgent:
                         }
                     # If parsing fails, we falls through (raw content was already yielded)
                 
-                # --- RAW HISTORY LOGGING (DB) ---
                 # --- RAW HISTORY LOGGING (ASSISTANT DB) ---
-                print(f"[DEBUG:Core] About to save raw history for chat {chat_id}", flush=True)
+                logger.debug("[DEBUG:Core] About to save raw history for chat %s", chat_id)
                 try:
-                    from modules.db import save_raw_history
-                    save_raw_history(chat_id, {
+                    self._log_raw_history(chat_id, {
                         "timestamp": datetime.datetime.now().isoformat(),
                         "chat_id": chat_id,
                         "model_config": self.provider.model_cfg if hasattr(self.provider, 'model_cfg') else {},
@@ -995,7 +1105,10 @@ class AIAgent:
             print(f"Error in ask_stream: {e}")
             yield {"status": "error", "error": str(e), "chat_id": chat_id}
         finally:
-             p.nice(original_priority)
+             # A stopped or disconnected stream still keeps what it received
+             entry_writer.flush()
+             if original_priority is not None:
+                 self._restore_priority(original_priority)
 
     def _yield_from_queue(self, q):
         while True:
@@ -1009,6 +1122,13 @@ class AIAgent:
     def shutdown(self):
         self.stop_event.set()
         self.request_queue.put(None)
+        self.action_executor.shutdown_workers()
+        if self._thread_pool is not None:
+            self._thread_pool.shutdown(wait=False)
+        # Flush pending history logs
+        if self._log_pid == os.getpid() and self._log_thread.is_alive():
+            self._log_q.put(None)
+            self._log_thread.join(timeout=5)
 
     def get_history(self, parent_id, chat_id=None):
         return load_history_entries(parent_id, chat_id=chat_id)
@@ -1033,7 +1153,7 @@ class AIAgent:
 
     def ask(self, prompt, use_thinking=True, priority="normal", return_json=False, prompt_id="general_chat", chat_id=None):
         final_thinking = ""
-        final_content = ""
+        content_parts = []  # Joined once at the end instead of re-concatenated per chunk
         # Create ephemeral chat ID for single-shot asks if not provided
         if not chat_id:
             chat_id = f"ask_{uuid.uuid4().hex[:8]}"
@@ -1042,7 +1162,7 @@ class AIAgent:
             if chunk["status"] == "thinking_finished":
                 final_thinking = chunk["thinking"]
             elif chunk["status"] == "json_content":
-                final_content = chunk.get("message", "")
+                content_parts = [chunk.get("message", "")]
             elif chunk["status"] == "content":
-                final_content += chunk.get("chunk", "")
-        return {"thinking": final_thinking, "content": final_content}
+                content_parts.append(chunk.get("chunk", ""))
+        return {"thinking": final_thinking, "content": "".join(content_parts)}
@@ -2,8 +2,7 @@
 import os
 import traceback
 from modules.config import load_settings
-from modules.db import init_db 
-import sqlite3
+from modules.db import init_db, get_user_preferred_model as db_get_user_preferred_model
 
 # Import Providers
 # We use lazy imports inside get_provider to avoid circular dependency issues if any,
@@ -15,22 +14,8 @@ _PROVIDER_CACHE = {}
 
 def get_user_preferred_model(user_id):
     """Fetches the user's preferred model ID from the database."""
-    if not user_id:
-        return None
-        
     try:
-        # Assuming db_path is standard
-        base_dir = os.path.dirname(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
-        db_path = os.path.join(base_dir, "data", "system.db")
-        
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        cursor.execute("SELECT preferred_model FROM users WHERE id = ?", (user_id,))
-        row = cursor.fetchone()
-        conn.close()
-        
-        if row and row[0]:
-            return row[0]
+        return db_get_user_preferred_model(user_id)
     except Exception as e:
         print(f"[ProviderFactory] Error fetching user preference: {e}")
         traceback.print_exc()
@@ -10,17 +10,21 @@ import uuid
 from concurrent.futures import as_completed
 
 # Imports from other modules
+from modules import fastjson
 from modules.config import get_active_model_settings
 from modules.db import save_chat_item, load_chat_items, update_history_entry, get_chat_owner, save_raw_history, update_chat_title
 from modules.actions.registry import ActionRegistry
 from modules.actions.executor import ActionExecutor
 from modules.bot_config import get_bot_config
 from modules.prompt_builder import format_history_for_prompt, build_system_prompt
-from modules.permissions import check_permission, init_permissions_db
+from modules.permissions import check_permission
 from modules.utils import extract_json
 
 from .utils import GetTokenLength, clean_content, shrink_history
 
+# Legacy inline action call: [ACTION: name, {json args}]
+_ACTION_TAG_RE = re.compile(r'\[ACTION:\s*([a-zA-Z0-9_]+)\s*,\s*({.*?})\]', re.DOTALL)
+
 def run_worker_loop(agent):
     """
     Worker loop that processes requests from the agent's queue.
@@ -97,8 +101,7 @@ def run_worker_loop(agent):
                                 last_msg = m['content']
                                 break
                     
-                    pattern = r'\[ACTION:\s*([a-zA-Z0-9_]+)\s*,\s*({.*?})\]'
-                    match = re.search(pattern, last_msg, re.DOTALL)
+                    match = _ACTION_TAG_RE.search(last_msg)
                     if match:
                             action_name = match.group(1)
                             action_args_str = match.group(2)
@@ -111,7 +114,7 @@ def run_worker_loop(agent):
                                 if action_def:
                                     ctx = {"user_id": user_id, "chat_id": chat_id}
                                     exec_result = agent.action_executor.execute(action_def, action_args, ctx)
-                                    observation = json.dumps(exec_result.get("output", {})) if exec_result["status"] == "success" else f"Error: {exec_result.get('error')}"
+                                    observation = fastjson.dumps(exec_result.get("output", {})) if exec_result["status"] == "success" else f"Error: {exec_result.get('error')}"
                                     
                                     action_status = "success" if exec_result["status"] == "success" else "error"
                                     agent._broadcast(chat_id, {
@@ -196,8 +199,7 @@ def run_worker_loop(agent):
                                     found_actions.append({"name": ra["name"], "args": args})
                     
                     if found_actions:
-                         # Check Permissions
-                         init_permissions_db()
+                         # Check Permissions (table created in AIAgent.__init__)
                          paused = False
                          for act in found_actions:
                              if not check_permission(str(user_id), act["name"], chat_id=chat_id):
@@ -242,7 +244,7 @@ def run_worker_loop(agent):
                              if action_def:
                                  ctx = {"user_id": user_id, "chat_id": chat_id}
                                  exec_result = agent.action_executor.execute(action_def, act["args"], ctx)
-                                 out_str = json.dumps(exec_result.get("output", {})) if exec_result["status"] == "success" else f"Error: {exec_result.get('error')}"
+                                 out_str = fastjson.dumps(exec_result.get("output", {})) if exec_result["status"] == "success" else f"Error: {exec_result.get('error')}"
                                  
                                  # [DEBUG:Action]
                                  print(f"[DEBUG:Action] Action '{action_name}' returned: {out_str}", flush=True)
@@ -303,8 +305,7 @@ def run_worker_loop(agent):
                 p.nice(original_priority)
                 agent._broadcast(chat_id, None)
                 with agent.active_tasks_lock:
-                    if chat_id in agent.active_tasks:
-                        del agent.active_tasks[chat_id]
+                    agent.active_tasks.pop(chat_id, None)
                 agent.request_queue.task_done()
                 
         except queue.Empty:
@@ -2,12 +2,14 @@
 import re
 from modules.utils import extract_json
 
+_SYMBOL_RE = re.compile(r'[^a-zA-Z0-9\s]')
+
 def GetTokenLength(text):
     if not text:
         return 0
     # Heuristic: count words + symbols
     words = text.split()
-    symbols = re.findall(r'[^a-zA-Z0-9\s]', text)
+    symbols = _SYMBOL_RE.findall(text)
     return len(words) + len(symbols)
 
 def clean_content(content):
@@ -48,8 +50,12 @@ def shrink_history(history, max_tokens):
     if not remaining:
         return preserved
         
+    # Count each message once; every budget check below reuses these
+    lengths = [GetTokenLength(m['content']) for m in remaining]
+    preserved_tokens = sum(GetTokenLength(m['content']) for m in preserved)
+
     # If total length is fine, return as is
-    total_tokens = sum(GetTokenLength(m['content']) for m in remaining) + sum(GetTokenLength(m['content']) for m in preserved)
+    total_tokens = sum(lengths) + preserved_tokens
     if total_tokens <= max_tokens:
         return preserved + remaining
 
@@ -67,7 +73,7 @@ def shrink_history(history, max_tokens):
     filtered_older = []
     
     # Budget for older: max - preserved - recent
-    current_usage = sum(GetTokenLength(m['content']) for m in preserved) + sum(GetTokenLength(m['content']) for m in recent)
+    current_usage = preserved_tokens + sum(lengths[-KEEP_LAST_N:])
     budget = max_tokens - current_usage
     
     if budget <= 0:
@@ -76,16 +82,16 @@ def shrink_history(history, max_tokens):
         return preserved + recent
         
     # Greedy fill from NEWEST of "older" to OLDEST
-    for msg in reversed(older):
-        l = GetTokenLength(msg['content'])
-        
+    for msg, l in zip(reversed(older), reversed(lengths[:-KEEP_LAST_N])):
         # Heuristic: If it's a huge assistant message (likely code or thought), skip it or truncate
         # For now, we skip if > 500 tokens and it's assistant
         if msg['role'] == 'assistant' and l > 500:
              continue
              
         if l <= budget:
-            filtered_older.insert(0, msg)
+            filtered_older.append(msg)
             budget -= l
-            
+
+    # Collected newest-first; restore chronological order once
+    filtered_older.reverse()
     return preserved + filtered_older
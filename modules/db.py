@@ -1,7 +1,46 @@
 import sqlite3
 import os
 import json
+import time
+import threading
 from werkzeug.security import generate_password_hash
+from modules import fastjson
+
+class _ThreadConnection(sqlite3.Connection):
+    """
+    Connection reused by every query on one thread. close() only ends the
+    caller's unit of work (rolling back anything left uncommitted, as a real
+    close would); the handle stays open for the thread's next call.
+    """
+    def close(self):
+        if self.in_transaction:
+            self.rollback()
+
+    def close_for_real(self):
+        super().close()
+
+
+_tls = threading.local()
+
+def _connect(db_path):
+    """Returns this thread's connection for db_path, opening it on first use."""
+    conns = getattr(_tls, "conns", None)
+    if conns is None or _tls.pid != os.getpid():
+        # First use on this thread, or inherited across fork (never reuse those)
+        conns = _tls.conns = {}
+        _tls.pid = os.getpid()
+
+    conn = conns.get(db_path)
+    if conn is None:
+        conn = sqlite3.connect(db_path, factory=_ThreadConnection)
+        # WAL (set once in init_db) makes NORMAL safe and skips an fsync per commit
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        conns[db_path] = conn
+    elif conn.in_transaction:
+        # A previous caller raised before commit/close; don't inherit its writes
+        conn.rollback()
+    return conn
 
 def init_db():
     base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
@@ -11,8 +50,12 @@ def init_db():
     if not os.path.exists(os.path.dirname(db_path)):
         os.makedirs(os.path.dirname(db_path))
         
-    conn = sqlite3.connect(db_path)
+    conn = _connect(db_path)
     cursor = conn.cursor()
+
+    # Write-ahead logging: readers don't block the writer and vice versa.
+    # The mode is stored in the database file, so this sticks for every connection.
+    cursor.execute("PRAGMA journal_mode=WAL")
     
     # Create users table
     cursor.execute('''
@@ -130,7 +173,7 @@ def save_chat_item(chat_id, role, content, thinking=None):
     print(f"[DEBUG:DB] save_chat_item[{role}] chat_id={chat_id} content_len={len(content) if content else 0}", flush=True)
     
     try:
-        conn = sqlite3.connect(db_path)
+        conn = _connect(db_path)
         cursor = conn.cursor()
         
         # Insert
@@ -152,6 +195,26 @@ def save_chat_item(chat_id, role, content, thinking=None):
         print(f"[Error:DB] In save_chat_item: {e}")
         return None
 
+def save_chat_items_bulk(chat_id, items):
+    """Inserts several (role, content) items for one chat in a single transaction."""
+    if not items:
+        return
+    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    db_path = os.path.join(base_dir, "data", "system.db")
+    print(f"[DEBUG:DB] save_chat_items_bulk chat_id={chat_id} count={len(items)}", flush=True)
+    
+    try:
+        conn = _connect(db_path)
+        with conn:
+            conn.executemany(
+                "INSERT INTO chat_items (chat_id, role, content) VALUES (?, ?, ?)",
+                [(chat_id, role, content) for role, content in items]
+            )
+            conn.execute("UPDATE chats SET updated_at = CURRENT_TIMESTAMP WHERE id = ?", (chat_id,))
+        conn.close()
+    except Exception as e:
+        print(f"[Error:DB] In save_chat_items_bulk: {e}")
+
 # Deprecated: usage of parent_id
 def save_history_entry(parent_id, role, content, thinking=None, chat_id=None):
     if chat_id:
@@ -163,7 +226,7 @@ def update_history_entry(entry_id, content=None, thinking=None):
     db_path = os.path.join(base_dir, "data", "system.db")
     
     try:
-        conn = sqlite3.connect(db_path)
+        conn = _connect(db_path)
         cursor = conn.cursor()
         if content is not None and thinking is not None:
             cursor.execute("UPDATE chat_items SET content = ?, thinking = ? WHERE id = ?", (content, thinking, entry_id))
@@ -181,7 +244,7 @@ def update_history_entry(entry_id, content=None, thinking=None):
 def load_chat_items(chat_id):
     base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     db_path = os.path.join(base_dir, "data", "system.db")
-    conn = sqlite3.connect(db_path)
+    conn = _connect(db_path)
     cursor = conn.cursor()
     
     cursor.execute(
@@ -206,7 +269,7 @@ def load_history_entries(parent_id=None, chat_id=None):
 def create_chat(chat_id, user_id, title="New Chat"):
     base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     db_path = os.path.join(base_dir, "data", "system.db")
-    conn = sqlite3.connect(db_path)
+    conn = _connect(db_path)
     cursor = conn.cursor()
     cursor.execute("INSERT OR IGNORE INTO chats (id, user_id, title, updated_at) VALUES (?, ?, ?, CURRENT_TIMESTAMP)", (chat_id, user_id, title))
     conn.commit()
@@ -215,7 +278,7 @@ def create_chat(chat_id, user_id, title="New Chat"):
 def get_chats_for_user(user_id):
     base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     db_path = os.path.join(base_dir, "data", "system.db")
-    conn = sqlite3.connect(db_path)
+    conn = _connect(db_path)
     cursor = conn.cursor()
     cursor.execute("SELECT id, title, created_at, updated_at FROM chats WHERE user_id = ? ORDER BY updated_at DESC", (user_id,))
     rows = cursor.fetchall()
@@ -225,7 +288,7 @@ def get_chats_for_user(user_id):
 def update_chat_title(chat_id, title):
     base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     db_path = os.path.join(base_dir, "data", "system.db")
-    conn = sqlite3.connect(db_path)
+    conn = _connect(db_path)
     cursor = conn.cursor()
     cursor.execute("UPDATE chats SET title = ? WHERE id = ?", (title, chat_id))
     conn.commit()
@@ -235,7 +298,7 @@ def get_chat_title(chat_id):
     """Get the title of a chat."""
     base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     db_path = os.path.join(base_dir, "data", "system.db")
-    conn = sqlite3.connect(db_path)
+    conn = _connect(db_path)
     cursor = conn.cursor()
     cursor.execute("SELECT title FROM chats WHERE id = ?", (chat_id,))
     row = cursor.fetchone()
@@ -246,7 +309,7 @@ def save_system_prompt(chat_id, system_prompt):
     """Save the populated system prompt for a chat session."""
     base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     db_path = os.path.join(base_dir, "data", "system.db")
-    conn = sqlite3.connect(db_path)
+    conn = _connect(db_path)
     cursor = conn.cursor()
     # Store as a special system role entry 
     cursor.execute(
@@ -259,7 +322,7 @@ def save_system_prompt(chat_id, system_prompt):
 def delete_chat(chat_id):
     base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     db_path = os.path.join(base_dir, "data", "system.db")
-    conn = sqlite3.connect(db_path)
+    conn = _connect(db_path)
     cursor = conn.cursor()
     cursor.execute("DELETE FROM history WHERE chat_id = ?", (chat_id,))
     cursor.execute("DELETE FROM chats WHERE id = ?", (chat_id,))
@@ -269,7 +332,7 @@ def delete_chat(chat_id):
 def clear_chat_history(chat_id):
     base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     db_path = os.path.join(base_dir, "data", "system.db")
-    conn = sqlite3.connect(db_path)
+    conn = _connect(db_path)
     cursor = conn.cursor()
     cursor.execute("DELETE FROM chat_items WHERE chat_id = ?", (chat_id,))
     conn.commit()
@@ -278,7 +341,7 @@ def clear_chat_history(chat_id):
 def clear_history_entries(parent_id=None):
     base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     db_path = os.path.join(base_dir, "data", "system.db")
-    conn = sqlite3.connect(db_path)
+    conn = _connect(db_path)
     cursor = conn.cursor()
     if parent_id:
         cursor.execute("DELETE FROM history WHERE parent_id = ?", (parent_id,))
@@ -293,7 +356,7 @@ def verify_user(username, password):
     from werkzeug.security import check_password_hash
     base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     db_path = os.path.join(base_dir, "data", "system.db")
-    conn = sqlite3.connect(db_path)
+    conn = _connect(db_path)
     cursor = conn.cursor()
     cursor.execute("SELECT id, username, password_hash, role FROM users WHERE username = ?", (username,))
     user = cursor.fetchone()
@@ -307,7 +370,7 @@ def log_raw_event(chat_id, role, content, thinking=None):
     """Logs raw input/output to the separate history table for debugging."""
     base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     db_path = os.path.join(base_dir, "data", "system.db")
-    conn = sqlite3.connect(db_path)
+    conn = _connect(db_path)
     cursor = conn.cursor()
     # history table: id, parent_id, chat_id, role, content, thinking, timestamp
     # We use parent_id='raw_log' to denote these entries if needed, or just ignore it.
@@ -321,7 +384,7 @@ def log_raw_event(chat_id, role, content, thinking=None):
 def get_all_history_items(search_query=None):
     base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     db_path = os.path.join(base_dir, "data", "system.db")
-    conn = sqlite3.connect(db_path)
+    conn = _connect(db_path)
     cursor = conn.cursor()
     
     # Switch to querying the 'history' table (raw logs) instead of 'chat_items'
@@ -365,7 +428,7 @@ def get_all_history_items(search_query=None):
 def get_chat_owner(chat_id):
     base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     db_path = os.path.join(base_dir, "data", "system.db")
-    conn = sqlite3.connect(db_path)
+    conn = _connect(db_path)
     cursor = conn.cursor()
     cursor.execute("SELECT user_id FROM chats WHERE id = ?", (chat_id,))
     row = cursor.fetchone()
@@ -374,9 +437,41 @@ def get_chat_owner(chat_id):
         return str(row[0])
     return None
 
+# user_id -> (expires_at, preferred_model); read on every chat request, rarely changed
+PREFERENCE_CACHE_TTL = 30.0
+_preferred_model_cache = {}
+
+def get_user_preferred_model(user_id):
+    """Returns the user's preferred model ID (or None), cached for a short TTL."""
+    if not user_id:
+        return None
+    key = str(user_id)
+    now = time.monotonic()
+    cached = _preferred_model_cache.get(key)
+    if cached and cached[0] > now:
+        return cached[1]
+
+    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    db_path = os.path.join(base_dir, "data", "system.db")
+    conn = _connect(db_path)
+    try:
+        row = conn.execute("SELECT preferred_model FROM users WHERE id = ?", (user_id,)).fetchone()
+    finally:
+        conn.close()
+    model = row[0] if row and row[0] else None
+    _preferred_model_cache[key] = (now + PREFERENCE_CACHE_TTL, model)
+    return model
+
 if __name__ == "__main__":
     init_db()
 
+def _raw_history_row(chat_id, data_dict):
+    # We store the main fields in columns for easy querying, and the full blob in raw_data
+    # Using parent_id='raw' to distinguish these rows if needed, or just let them live alongside others
+    response = data_dict.get("response", {})
+    extracted_role = response.get("role", "assistant")
+    return ("raw_log", chat_id, extracted_role, response.get("content", ""), response.get("thinking", ""), fastjson.dumps(data_dict))
+
 def save_raw_history(chat_id, data_dict):
     """
     Saves the full raw interaction data (JSON) to the history table.
@@ -385,17 +480,12 @@ def save_raw_history(chat_id, data_dict):
     db_path = os.path.join(base_dir, "data", "system.db")
     
     try:
-        conn = sqlite3.connect(db_path)
+        conn = _connect(db_path)
         cursor = conn.cursor()
         
-        # We store the main fields in columns for easy querying, and the full blob in raw_data
-        # Using parent_id='raw' to distinguish these rows if needed, or just let them live alongside others
-        
-        extracted_role = data_dict.get("response", {}).get("role", "assistant")
-        
         cursor.execute(
             "INSERT INTO history (parent_id, chat_id, role, content, thinking, raw_data) VALUES (?, ?, ?, ?, ?, ?)",
-            ("raw_log", chat_id, extracted_role, data_dict.get("response", {}).get("content", ""), data_dict.get("response", {}).get("thinking", ""), json.dumps(data_dict, ensure_ascii=False))
+            _raw_history_row(chat_id, data_dict)
         )
         
         row_id = cursor.lastrowid
@@ -408,6 +498,24 @@ def save_raw_history(chat_id, data_dict):
         print(f"[Error:DB] Error saving raw history: {e}")
         return None
 
+def save_raw_history_bulk(entries):
+    """Saves several (chat_id, data_dict) raw history entries in a single transaction."""
+    if not entries:
+        return
+    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    db_path = os.path.join(base_dir, "data", "system.db")
+    
+    try:
+        conn = _connect(db_path)
+        with conn:
+            conn.executemany(
+                "INSERT INTO history (parent_id, chat_id, role, content, thinking, raw_data) VALUES (?, ?, ?, ?, ?, ?)",
+                [_raw_history_row(chat_id, data_dict) for chat_id, data_dict in entries]
+            )
+        conn.close()
+    except Exception as e:
+        print(f"[Error:DB] Error saving raw history: {e}")
+
 def save_api_key(provider, raw_key):
     """Encrypts and saves an API key."""
     from modules.security import encrypt_value
@@ -419,7 +527,7 @@ def save_api_key(provider, raw_key):
         return False
         
     try:
-        conn = sqlite3.connect(db_path)
+        conn = _connect(db_path)
         cursor = conn.cursor()
         
         # Check if exists
@@ -445,7 +553,7 @@ def get_api_key(provider):
     db_path = os.path.join(base_dir, "data", "system.db")
     
     try:
-        conn = sqlite3.connect(db_path)
+        conn = _connect(db_path)
         cursor = conn.cursor()
         cursor.execute("SELECT api_key_enc FROM keys WHERE provider = ?", (provider,))
         row = cursor.fetchone()
@@ -1,4 +1,17 @@
+import threading
+
 from modules.ai_agent import AIAgent
 
-# Global singleton for the AI Agent
-agent = AIAgent()
+# Global singleton for the AI Agent. Built by get_agent() in the serving process
+# (create_app), never at import, so launchers and a gunicorn master start no threads.
+agent = None
+_agent_lock = threading.Lock()
+
+def get_agent() -> AIAgent:
+    """Returns the agent, building it on first use."""
+    global agent
+    if agent is None:
+        with _agent_lock:
+            if agent is None:
+                agent = AIAgent()
+    return agent
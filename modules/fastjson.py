@@ -0,0 +1,39 @@
+"""
+Fast JSON helpers.
+Uses orjson when it is installed and falls back to the stdlib json module otherwise.
+"""
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def loads(data):
+    """Parse JSON from a str or bytes payload."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def load_file(path: str):
+    """Parse a JSON file. Reads raw bytes, so there is no text-decoding pass."""
+    with open(path, 'rb') as f:
+        return loads(f.read())
+
+
+def dumps_bytes(obj) -> bytes:
+    """Serialize to UTF-8 encoded JSON bytes."""
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj)
+        except TypeError:
+            # orjson rejects non-str keys and ints over 64 bits; let stdlib handle them
+            pass
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+
+def dumps(obj) -> str:
+    """Serialize to a JSON string."""
+    return dumps_bytes(obj).decode("utf-8")
@@ -2,6 +2,7 @@
 import sqlite3
 import os
 import json
+import time
 from datetime import datetime, date
 
 # Permission Scopes
@@ -10,6 +11,12 @@ SCOPE_SESSION = "session" # This chat
 SCOPE_TODAY = "today"
 SCOPE_ALWAYS = "always"
 
+# Granted permissions are remembered briefly so multi-round action chains don't
+# re-query them. Only grants are cached: a denial must see a new grant at once.
+PERMISSION_CACHE_TTL = 30.0
+PERMISSION_CACHE_SIZE = 1024
+_granted_cache = {}  # (user_id, action_name, chat_id) -> expiry (monotonic)
+
 def init_permissions_db():
     base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
     db_path = os.path.join(base_dir, "data", "system.db")
@@ -34,6 +41,25 @@ def init_permissions_db():
     conn.close()
 
 def check_permission(user_id, action_name, chat_id=None):
+    """
+    Checks if a permission exists for the action (see _lookup_permission).
+    Grants are cached for PERMISSION_CACHE_TTL seconds.
+    """
+    key = (user_id, action_name, chat_id)
+    now = time.monotonic()
+    expires = _granted_cache.get(key)
+    if expires and expires > now:
+        return True
+    
+    if not _lookup_permission(user_id, action_name, chat_id):
+        return False
+    
+    if len(_granted_cache) >= PERMISSION_CACHE_SIZE:
+        _granted_cache.clear()
+    _granted_cache[key] = now + PERMISSION_CACHE_TTL
+    return True
+
+def _lookup_permission(user_id, action_name, chat_id=None):
     """
     Checks if a permission exists for the action.
     Returns: True if permitted (via ALWAYS, TODAY, or SESSION), False otherwise.
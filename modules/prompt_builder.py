@@ -1,7 +1,13 @@
 import json
 import os
+import re
+import threading
+from collections import OrderedDict
 from typing import Dict, List, Optional
 
+# Leftover [tag] placeholders (alphanumeric + underscore) stripped from built prompts
+_TAG_RE = re.compile(r'\[[a-z_0-9]+\]')
+
 def load_prompts() -> Dict:
     """Load prompt templates from prompts.json"""
     # Get Genesis root: from modules/prompt_builder.py go up one level
@@ -12,13 +18,35 @@ def load_prompts() -> Dict:
         return json.load(f)
 
 
+# Built prompts keyed by everything they depend on, least recently used first;
+# see build_system_prompt(actions_key=...)
+PROMPT_CACHE_SIZE = 256
+_prompt_cache: "OrderedDict[tuple, str]" = OrderedDict()
+# Request threads share the cache; reordering and eviction aren't atomic on their own
+_prompt_cache_lock = threading.Lock()
+# Stand-in for action_data when a prompt is rendered once and filled in later with
+# str.replace (it survives the tag/newline cleanup and can't occur in real text)
+ACTION_DATA_SLOT = "\x00action_data\x00"
+# (actions_key, rendered action list); shared by every prompt built for one registry version
+_actions_text_cache: Optional[tuple] = None
+
+
+def _prompts_mtime() -> int:
+    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    try:
+        return os.stat(os.path.join(base_dir, "data", "prompts.json")).st_mtime_ns
+    except OSError:
+        return 0
+
+
 def build_system_prompt(
     user_id: str,
     available_actions: List[Dict],
     action_data: str = "",
     bot_config: Dict = None,
     prompt_id: str = "user_chat",
-    user_message: str = ""
+    user_message: str = "",
+    actions_key: Optional[int] = None
 ) -> str:
     """
     Build a complete system prompt with bot personality and available actions.
@@ -30,7 +58,44 @@ def build_system_prompt(
         bot_config: Bot configuration (name, personality)
         prompt_id: The ID of the prompt template to use from prompts.json
         user_message: The original user message (for action_formater)
+        actions_key: Value that changes whenever available_actions does (e.g. the
+            registry version). When given, the prompt is memoized with action_data
+            left as ACTION_DATA_SLOT, and this call's action_data is spliced in.
     """
+    global _actions_text_cache
+    if actions_key is None:
+        return _build_system_prompt(_render_actions(available_actions), action_data, bot_config, prompt_id, user_message)
+    
+    bot_config = bot_config or {}
+    # action_data is live plugin output (clock, CPU load, ...) and would make every key unique
+    slot = ACTION_DATA_SLOT if action_data else ""
+    key = (
+        _prompts_mtime(), actions_key, prompt_id, user_message, slot,
+        bot_config.get("name", "Genesis AI"), bot_config.get("personality", "")
+    )
+    with _prompt_cache_lock:
+        cached = _prompt_cache.get(key)
+        if cached is not None:
+            _prompt_cache.move_to_end(key)
+    if cached is None:
+        # Rendered outside the lock since it reads prompts.json; a racing thread at worst
+        # renders the same prompt too. The action list is rendered once per registry version.
+        actions_text = _actions_text_cache
+        if actions_text is None or actions_text[0] != actions_key:
+            actions_text = _actions_text_cache = (actions_key, _render_actions(available_actions))
+        cached = _build_system_prompt(actions_text[1], slot, bot_config, prompt_id, user_message)
+        with _prompt_cache_lock:
+            _prompt_cache[key] = cached
+            if len(_prompt_cache) > PROMPT_CACHE_SIZE:
+                # Evict the coldest entry only; one-off action_formater prompts (keyed on the
+                # user's message) shouldn't flush the user_chat prompts every chat reuses
+                _prompt_cache.popitem(last=False)
+    if not action_data or action_data == ACTION_DATA_SLOT:
+        return cached
+    return cached.replace(ACTION_DATA_SLOT, action_data)
+
+
+def _build_system_prompt(actions_text, action_data, bot_config, prompt_id, user_message) -> str:
     prompts = load_prompts()
     template = prompts.get(prompt_id, prompts.get("user_chat", ""))
     
@@ -59,46 +124,20 @@ def build_system_prompt(
     else:
         template = template.replace("[action_data]", "")
     
-    # Build available actions list (exclude pre_request actions - those run automatically)
-    if available_actions:
-        actions_text = ""
-        for action in available_actions:
-            # Skip pre_request actions - they run automatically before each request
-            if action.get("trigger") == "pre_request":
-                continue
-                
-            spec = action.get("spec")
-            if not spec:
-                # Fallback: assume the action itself is the spec (flat structure)
-                spec = action
-            name = spec.get("name", "unknown")
-            description = spec.get("description", "No description")
-            params = spec.get("parameters", {})
-            
-            params_text = ", ".join([f'"{k}": <{v}>' for k, v in params.items()])
-            actions_text += f"- **{name}**: {description}\n"
-            if params_text:
-                actions_text += f"  Parameters: {{{params_text}}}\n"
-            else:
-                actions_text += f"  Parameters: None\n"
-        
-        if actions_text:
-            template = template.replace("[actions]", actions_text)
-            # Cleanup old tag if present (legacy support/safety)
-            template = template.replace("[available_actions]", actions_text)
-        else:
-            template = template.replace("[actions]", "No actions currently available.")
-            template = template.replace("[available_actions]", "No actions currently available.")
+    # Inject available actions list (see _render_actions)
+    if actions_text:
+        template = template.replace("[actions]", actions_text)
+        # Cleanup old tag if present (legacy support/safety)
+        template = template.replace("[available_actions]", actions_text)
     else:
         template = template.replace("[actions]", "No actions currently available.")
         template = template.replace("[available_actions]", "No actions currently available.")
 
     # 4. Final Sanitization: Remove any remaining [tag] placeholders
     # We use a regex to find any remaining bracketed identifiers that look like tags
-    import re
     # Remove tags like [some_tag] but try to avoid removing standard brackets if possible.
     # We assume valid tags are alphanumeric + underscore.
-    template = re.sub(r'\[[a-z_0-9]+\]', '', template)
+    template = _TAG_RE.sub('', template)
     
     # Clean up any double newlines from removed placeholders
     while "\n\n\n" in template:
@@ -106,6 +145,31 @@ def build_system_prompt(
     
     return template.strip()
 
+def _render_actions(available_actions: List[Dict]) -> str:
+    """Renders the action list for the prompt; empty when there is nothing to offer."""
+    # Exclude pre_request actions - those run automatically
+    lines = []
+    for action in available_actions or ():
+        # Skip pre_request actions - they run automatically before each request
+        if action.get("trigger") == "pre_request":
+            continue
+            
+        spec = action.get("spec")
+        if not spec:
+            # Fallback: assume the action itself is the spec (flat structure)
+            spec = action
+        name = spec.get("name", "unknown")
+        description = spec.get("description", "No description")
+        params = spec.get("parameters", {})
+        
+        params_text = ", ".join([f'"{k}": <{v}>' for k, v in params.items()])
+        lines.append(f"- **{name}**: {description}\n")
+        if params_text:
+            lines.append(f"  Parameters: {{{params_text}}}\n")
+        else:
+            lines.append(f"  Parameters: None\n")
+    return "".join(lines)
+
 def format_history_for_prompt(history: List[Dict], system_prompt: str) -> List[Dict]:
     """
     Format history for the prompt.
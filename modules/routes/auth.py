@@ -1,7 +1,6 @@
 from flask import Blueprint, request, jsonify, render_template, redirect, url_for
 from flask_login import login_user, logout_user, login_required, current_user, UserMixin
 from werkzeug.security import check_password_hash, generate_password_hash
-from modules.extensions import agent
 import sqlite3
 import os
 
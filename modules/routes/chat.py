@@ -1,6 +1,6 @@
 from flask import Blueprint, request, jsonify, Response, stream_with_context
 from flask_login import login_required, current_user
-from modules.extensions import agent
+from modules.extensions import get_agent
 from modules.config import get_startup_thinking_mode
 from modules.db import get_chats_for_user, create_chat, delete_chat, clear_chat_history
 import json
@@ -47,6 +47,8 @@ def chat():
     chat_id = data.get("chat_id")
     resume_action = data.get("resume_action", False)
     
+    agent = get_agent()
+    
     # Check if we are just resubscribing
     is_resubscribe = False
     with agent.active_tasks_lock:
@@ -82,7 +84,7 @@ def clear_history():
 @login_required
 def get_history():
     chat_id = request.args.get("chat_id")
-    history = agent.get_history(chat_id=chat_id)
+    history = get_agent().get_history(chat_id=chat_id)
     return jsonify(history)
 
 @chat_bp.route("/api/action/cancel", methods=["POST"])
@@ -94,7 +96,7 @@ def cancel_action_api():
     if not chat_id:
         return jsonify({"status": "error", "error": "Missing chat_id"}), 400
     
-    success = agent.cancel_current_action(chat_id)
+    success = get_agent().cancel_current_action(chat_id)
     if success:
         return jsonify({"status": "success", "message": "Action cancelled"})
     else:
@@ -1,7 +1,6 @@
 from flask import Blueprint, request, jsonify, send_file
 from flask_login import login_required, current_user
 from modules.decorators import admin_required
-from modules.extensions import agent
 from modules.bot_config import get_bot_config, save_bot_config
 from modules.permissions import grant_permission
 from modules.tasks import get_scheduler
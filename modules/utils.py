@@ -1,23 +1,30 @@
 import json
 import re
 
+_BRACE_RE = re.compile(r'[{}]')
+
 def extract_json(text):
     """
     Extracts a JSON object from a string, handling markdown code blocks.
     """
+    # Spans are located with str.find/rfind (a memchr-style scan) rather than regex
+    
     # Try to find JSON block in markdown
-    json_match = re.search(r'```json\s*([\s\S]*?)\s*```', text)
-    if json_match:
-        try:
-            return json.loads(json_match.group(1))
-        except json.JSONDecodeError:
-            pass
+    fence_start = text.find("```json")
+    if fence_start != -1:
+        fence_end = text.find("```", fence_start + 7)
+        if fence_end != -1:
+            try:
+                return json.loads(text[fence_start + 7:fence_end].strip())
+            except json.JSONDecodeError:
+                pass
             
     # Try to find anything between { and }
-    brace_match = re.search(r'(\{[\s\S]*\})', text)
-    if brace_match:
+    brace_start = text.find("{")
+    brace_end = text.rfind("}")
+    if brace_start != -1 and brace_end > brace_start:
         try:
-            return json.loads(brace_match.group(1))
+            return json.loads(text[brace_start:brace_end + 1])
         except json.JSONDecodeError:
             pass
             
@@ -40,7 +47,9 @@ def extract_json(text):
     # (Simple stack approach)
     stack = []
     start_idx = -1
-    for i, char in enumerate(text):
+    # Visit only the braces instead of every character
+    for match in _BRACE_RE.finditer(text):
+        i, char = match.start(), match.group()
         if char == '{':
             if not stack:
                 start_idx = i
@@ -58,3 +67,111 @@ def extract_json(text):
                         pass
     
     return None
+
+# Characters that can change JSON structure; everything else is skipped in bulk
+_JSON_TOKEN_RE = re.compile(r'[{}\[\]":\\]')
+
+class StreamingActionParser:
+    """
+    Picks the objects of a top-level "actions" array out of a streamed reply,
+    one chunk at a time. Each chunk is scanned once, visiting only structural
+    characters, and each action is parsed as soon as its closing brace arrives,
+    instead of re-extracting the whole reply at the end.
+
+    Text before the first '{' is ignored, as are top-level objects without an
+    "actions" key. Replies this can't follow (e.g. a stray '{' in prose) leave
+    `actions` empty with `saw_object` set, so callers can fall back to extract_json.
+    """
+    def __init__(self):
+        self.actions = []        # Completed action dicts, in order
+        self.saw_object = False  # A '{' appeared outside of any string
+        self._done = False       # The actions array has closed
+        self._stack = []         # Open '{' / '[' outside strings
+        self._in_string = False
+        self._escape_pos = -1    # Absolute position of the char escaped by a backslash
+        self._offset = 0         # Absolute position of the current chunk's first char
+        self._tail = ""          # Last few chars seen, for strings that span chunks
+        self._str_start = 0      # Absolute position after the opening quote
+        self._last_str = None    # Last short top-level string (candidate key)
+        self._key = None         # Key whose value is being read at the top level
+        self._in_actions = False
+        self._capture = None     # Chunks of the action object being read
+
+    def feed(self, chunk: str) -> list:
+        """Consumes a chunk and returns the actions it completed."""
+        if self._done or not chunk:
+            return []
+        
+        found = []
+        capture_from = 0 if self._capture is not None else None
+        stack = self._stack
+        offset = self._offset
+        for match in _JSON_TOKEN_RE.finditer(chunk):
+            i, char = match.start(), match.group()
+            if offset + i == self._escape_pos:
+                continue
+            
+            if self._in_string:
+                if char == '\\':
+                    self._escape_pos = offset + i + 1
+                elif char == '"':
+                    self._in_string = False
+                    if len(stack) == 1 and offset + i - self._str_start == len("actions"):
+                        self._last_str = (self._tail + chunk[:i])[-len("actions"):]
+                continue
+            
+            if not stack:
+                # Outside any object: only a new top-level object matters
+                if char == '{':
+                    stack.append(char)
+                    self.saw_object = True
+                    self._key = self._last_str = None
+                continue
+            
+            if char == '"':
+                self._in_string = True
+                self._str_start = offset + i + 1
+                self._last_str = None
+            elif char == ':':
+                if len(stack) == 1:
+                    self._key = self._last_str
+            elif char in '{[':
+                stack.append(char)
+                if char == '[' and len(stack) == 2 and self._key == "actions":
+                    self._in_actions = True
+                elif char == '{' and self._in_actions and len(stack) == 3:
+                    self._capture = []
+                    capture_from = i
+            else:
+                if stack.pop() != ('{' if char == '}' else '['):
+                    # Mismatched brackets: not JSON we can follow
+                    self._reset()
+                    capture_from = None
+                    continue
+                if self._in_actions:
+                    if len(stack) == 2 and self._capture is not None:
+                        text = "".join(self._capture) + chunk[capture_from:i + 1]
+                        self._capture = capture_from = None
+                        try:
+                            action = json.loads(text)
+                        except json.JSONDecodeError:
+                            action = None
+                        if isinstance(action, dict):
+                            found.append(action)
+                    elif len(stack) == 1:
+                        # Actions array closed; the rest of the reply doesn't matter
+                        self._done = True
+                        break
+        
+        if self._capture is not None and capture_from is not None:
+            self._capture.append(chunk[capture_from:])
+        self._offset = offset + len(chunk)
+        self._tail = (self._tail + chunk)[-len("actions"):]
+        self.actions.extend(found)
+        return found
+
+    def _reset(self):
+        self._stack.clear()
+        self._key = self._last_str = None
+        self._in_actions = False
+        self._capture = None
@@ -0,0 +1,55 @@
+import sys
+import os
+
+# Add project root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import modules.ai_agent.core
+from modules.ai_agent.core import AIAgent
+from modules.db import init_db
+
+USER_ID = "test_routing_user"
+PREFERRED_MODEL = "test-preferred-model"
+
+# Chat owner and model preference without needing user rows in the DB
+modules.ai_agent.core.get_chat_owner = lambda chat_id: USER_ID
+modules.ai_agent.core.get_user_preferred_model = lambda user_id: PREFERRED_MODEL if user_id == USER_ID else None
+
+class RecordingProvider:
+    """Records the arguments of each generate() call and replies with plain text."""
+    def __init__(self):
+        self.calls = []
+
+    def generate(self, prompt, **kwargs):
+        self.calls.append(kwargs)
+        yield {"status": "content", "chunk": "Hello!"}
+
+def test_provider_routing():
+    print("[TEST] Initializing Agent with RecordingProviders...")
+    init_db()  # ask_stream saves to the chat tables
+    agent = AIAgent()
+    default_provider = RecordingProvider()
+    preferred_provider = RecordingProvider()
+    agent._get_provider = lambda model_id=None: preferred_provider if model_id == PREFERRED_MODEL else default_provider
+
+    history = [
+        {"role": "system", "content": "STALE SYSTEM PROMPT"},
+        {"role": "user", "content": "Say hello"}
+    ]
+
+    print("[TEST] Streaming...")
+    list(agent.ask_stream("Say hello", use_thinking=False, chat_id="test_provider_routing_chat", history_override=history))
+    agent.shutdown()
+
+    # The chat owner's preferred model answers, not the global default
+    assert len(preferred_provider.calls) == 1, preferred_provider.calls
+    assert default_provider.calls == [], default_provider.calls
+
+    # The freshly built system prompt goes out-of-band; the history carries no system message
+    call = preferred_provider.calls[0]
+    assert call["system_prompt"] and "STALE SYSTEM PROMPT" not in call["system_prompt"], call["system_prompt"]
+    assert call["history_override"] == [{"role": "user", "content": "Say hello"}], call["history_override"]
+    print("[SUCCESS] Preferred provider got the built system prompt and a system-free history.")
+
+if __name__ == "__main__":
+    test_provider_routing()
@@ -0,0 +1,38 @@
+import sys
+import os
+
+# Add project root to path
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+from modules.ai_agent.core import AIAgent
+from modules.db import init_db
+
+CHUNKS = ["Hello", ", ", "world", "!"]
+
+class ChunkProvider:
+    """Streams a fixed plain-text reply (no actions), one content event per chunk."""
+    def generate(self, prompt, use_thinking=False, stop_event=None, return_json=False, parent_id=None, history_override=None, system_prompt=None):
+        for chunk in CHUNKS:
+            yield {"status": "content", "chunk": chunk}
+
+def test_stream_emission():
+    print("[TEST] Initializing Agent with ChunkProvider...")
+    init_db()  # ask_stream saves to the chat tables
+    agent = AIAgent()
+    provider = ChunkProvider()
+    agent._get_provider = lambda model_id=None: provider
+    
+    print("[TEST] Streaming...")
+    emitted = []
+    for event in agent.ask_stream("Say hello", use_thinking=False, chat_id="test_stream_emission_chat"):
+        if event.get("status") == "content":
+            emitted.append(event.get("chunk"))
+    
+    agent.shutdown()
+    
+    # Each provider chunk must reach the caller exactly once
+    assert emitted == CHUNKS, (CHUNKS, emitted)
+    print("[SUCCESS] One emission per provider chunk.")
+
+if __name__ == "__main__":
+    test_stream_emission()